@@ -0,0 +1,54 @@
+import copy
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import LRUCache
+
+SHARED_KEY_PREFIX = 'auth:token:'
+
+token_cache = LRUCache(
+    maxsize=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе на каждый запрос.
+
+    Пользователь ищется сначала в кэше процесса, затем в общем кэше
+    Django и только потом в базе. Записи удаляются при выходе
+    пользователя и при любом изменении пользователя (смена пароля,
+    блокировка), см. api.signals. Кэш других процессов устаревает не
+    позже, чем через TOKEN_CACHE_LOCAL_TTL секунд.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            user = cache.get(SHARED_KEY_PREFIX + key)
+            if user is None:
+                user, _ = super().authenticate_credentials(key)
+                cache.set(
+                    SHARED_KEY_PREFIX + key, user,
+                    settings.TOKEN_CACHE_SHARED_TTL
+                )
+            token_cache.set(key, user)
+        # Представления могут менять request.user, кэшированный
+        # экземпляр должен остаться нетронутым.
+        user = copy.copy(user)
+        return user, Token(key=key, user=user)
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+    cache.delete(SHARED_KEY_PREFIX + key)
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list(
+            'key', flat=True):
+        invalidate_token(key)
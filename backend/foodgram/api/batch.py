@@ -0,0 +1,128 @@
+"""
+Пакетный запрос: несколько вызовов API за один HTTP-запрос.
+
+Подзапросы выполняются теми же представлениями через обычную
+маршрутизацию URL от имени пользователя исходного запроса. Подряд идущие
+GET-подзапросы можно выполнять параллельно в пуле потоков, запросы на
+изменение данных всегда выполняются по очереди в заданном порядке.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .serializers import BatchSerializer
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+
+class BatchView(APIView):
+    """
+    Принимает ``{"requests": [{"method", "path", "body"}], "parallel"}``
+    и возвращает ``{"responses": [{"status", "body"}]}`` в том же порядке.
+    """
+    # Права проверяют представления подзапросов
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        serializer = BatchSerializer(
+            data=request.data, context={'batch_path': request.path})
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['requests']
+        parallel = serializer.validated_data['parallel']
+
+        responses = []
+        for group in self.get_groups(items, parallel):
+            if len(group) > 1:
+                responses.extend(_executor.map(
+                    lambda item: self.run_in_thread(request, item), group))
+            else:
+                responses.append(self.run(request, group[0]))
+        return Response({'responses': responses}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def get_groups(items, parallel):
+        """Разбивает подзапросы на группы подряд идущих GET-запросов."""
+        groups = []
+        for item in items:
+            if (
+                parallel and groups and item['method'] == 'GET'
+                and groups[-1][-1]['method'] == 'GET'
+            ):
+                groups[-1].append(item)
+            else:
+                groups.append([item])
+        return groups
+
+    def run_in_thread(self, request, item):
+        try:
+            return self.run(request, item)
+        finally:
+            # Соединение потока пула не должно оставаться открытым
+            connection.close()
+
+    def run(self, request, item):
+        path, _, query = item['path'].partition('?')
+        try:
+            match = resolve(path)
+        except Resolver404:
+            match = None
+        # Путь может попасть в маршрут фронтенда, а не в представление API
+        if match is None or not issubclass(
+                getattr(match.func, 'cls', object), APIView):
+            return {
+                'status': status.HTTP_404_NOT_FOUND,
+                'body': {'detail': 'Страница не найдена.'},
+            }
+        response = match.func(
+            self.build_request(request, item['method'], path, query,
+                               item.get('body')),
+            *match.args, **match.kwargs
+        )
+        if hasattr(response, 'render'):
+            response.render()
+        return {
+            'status': response.status_code,
+            'body': self.get_body(response),
+        }
+
+    @staticmethod
+    def build_request(request, method, path, query, body):
+        content = b'' if body is None else json.dumps(body).encode()
+        environ = {
+            key: value for key, value in request.META.items()
+            if key.isupper() and key not in ('CONTENT_LENGTH', 'CONTENT_TYPE')
+        }
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'SCRIPT_NAME': '',
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': BytesIO(content),
+            'wsgi.url_scheme': request.scheme,
+        })
+        sub_request = WSGIRequest(environ)
+        if request.user.is_authenticated:
+            # Пользователь уже проверен, повторная аутентификация не нужна
+            sub_request._force_auth_user = request.user
+            sub_request._force_auth_token = request.auth
+        return sub_request
+
+    @staticmethod
+    def get_body(response):
+        if getattr(response, 'streaming', False) or not response.content:
+            return None
+        if response.get('Content-Type', '').startswith('application/json'):
+            return json.loads(response.content)
+        return response.content.decode(response.charset, errors='replace')
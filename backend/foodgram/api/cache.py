@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class LRUCache:
+    """
+    Потокобезопасный кэш процесса с вытеснением давно не используемых
+    записей и необязательным временем жизни.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+
+VERSION_KEY_PREFIX = 'version:'
+
+# Теги кэшируемых данных: отдельные объекты и коллекции целиком
+INGREDIENTS_TAG = 'ingredients'
+RECIPES_TAG = 'recipes'
+USERS_TAG = 'users'
+
+
+def recipe_tag(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def get_versions(tags):
+    """
+    Текущие версии тегов из общего кэша одним запросом.
+
+    Версия тега меняется при изменении данных, от которых он зависит,
+    поэтому ключи, включающие версии, устаревают сами собой.
+    """
+    keys = [VERSION_KEY_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {tag: versions[key] for tag, key in zip(tags, keys)}
+
+
+def bump_versions(*tags):
+    for tag in tags:
+        key = VERSION_KEY_PREFIX + tag
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Вытесненная версия начинается заново с нового значения,
+            # чтобы не совпасть со старыми ключами.
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate(*tags):
+    """
+    Меняет версии тегов сейчас и ещё раз после фиксации транзакции,
+    чтобы между изменением и фиксацией в кэш не попали старые данные.
+    """
+    bump_versions(*tags)
+    transaction.on_commit(lambda: bump_versions(*tags))
+
+
+def invalidate_recipe(recipe_id):
+    invalidate(recipe_tag(recipe_id), RECIPES_TAG)
+
+
+def invalidate_user(user_id):
+    invalidate(user_tag(user_id), USERS_TAG)
@@ -0,0 +1,120 @@
+"""
+Условные GET-запросы (ETag / Last-Modified).
+
+Валидаторы считаются одним лёгким запросом по временам изменения, до
+выборки и сериализации объектов, поэтому неизменившийся ресурс
+обходится клиенту ответом 304 без тяжёлой работы.
+"""
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from recipes.models import Favorite, ShoppingCart, Subscription, User
+
+
+def _relation_state(model):
+    """Количество и последний id связей пользователя: меняются при любом
+    добавлении или удалении."""
+    related = model.objects.filter(
+        user=OuterRef('pk')).order_by().values('user')
+    return (
+        Subquery(related.annotate(value=Count('pk')).values('value')),
+        Subquery(related.annotate(value=Max('pk')).values('value')),
+    )
+
+
+def get_viewer_state(user):
+    """Состояние избранного, списка покупок и подписок пользователя."""
+    annotations = {}
+    for model in (Favorite, ShoppingCart, Subscription):
+        name = model._meta.model_name
+        count, last = _relation_state(model)
+        annotations[f'{name}_count'] = count
+        annotations[f'{name}_last'] = last
+    return User.objects.filter(pk=user.pk).annotate(
+        **annotations).values_list(*annotations).get()
+
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+    ETag для list и retrieve, Last-Modified — только для retrieve.
+
+    Время изменения ресурса — максимум полей ``last_modified_fields``.
+    Удаление объекта и смена порядка списка его не меняют, поэтому
+    у списка время изменения входит только в ETag.
+    Ответ зависит и от пользователя (is_favorited, is_subscribed...),
+    поэтому для авторизованных в ETag входит состояние их связей,
+    а Last-Modified не отдаётся.
+    """
+    last_modified_fields = ('updated_at',)
+    # Число объектов в ETag замечает удаления. Представление, у которого
+    # удаления и так меняют get_etag_extra, может его не считать.
+    count_in_etag = True
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        aggregates = {
+            f'last_modified_{index}': Max(field)
+            for index, field in enumerate(self.last_modified_fields)
+        }
+        if self.count_in_etag:
+            aggregates['count'] = Count('pk')
+        state = queryset.order_by().aggregate(**aggregates)
+        count = state.pop('count', None)
+        query = sorted(request.query_params.lists())
+        return self._conditional_response(
+            ('list', count, query, *state.values(), *self.get_etag_extra()),
+            (),
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        values = self.get_queryset().filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        ).values_list(*self.last_modified_fields).first()
+        if values is None:
+            # 404 отдаст обычная обработка
+            return super().retrieve(request, *args, **kwargs)
+        return self._conditional_response(
+            ('detail', kwargs[lookup_url_kwarg],
+             sorted(request.query_params.lists()), *self.get_etag_extra()),
+            values,
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_etag_extra(self):
+        """Дополнительные данные, от которых зависит ответ."""
+        return ()
+
+    def _conditional_response(self, parts, timestamps, handler, request,
+                              *args, **kwargs):
+        timestamps = [value for value in timestamps if value is not None]
+        last_modified = max(timestamps) if timestamps else None
+        user = request.user
+        if user.is_authenticated:
+            etag = make_etag(
+                *parts, last_modified, user.pk, get_viewer_state(user))
+            last_modified = None
+        else:
+            etag = make_etag(*parts, last_modified)
+        etag = quote_etag(etag)
+        last_modified = (
+            int(last_modified.timestamp()) if last_modified else None)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
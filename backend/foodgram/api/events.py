@@ -0,0 +1,164 @@
+"""
+Публикация событий о новых рецептах для SSE-подписчиков.
+
+Событие публикуется через брокер, заданный настройкой
+RECIPE_EVENTS_BROKER. Брокер доставляет его в ``hub`` каждого процесса,
+где есть открытые SSE-соединения, а ``hub`` раскладывает событие по
+очередям соединений, подписанных на автора рецепта.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+
+
+class EventHub:
+    """Раздаёт события по asyncio-очередям открытых соединений."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    @contextmanager
+    def subscribe(self, author_ids):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        subscriber = (loop, queue)
+        with self._lock:
+            for author_id in author_ids:
+                self._subscribers.setdefault(author_id, set()).add(subscriber)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                for author_id in author_ids:
+                    subscribers = self._subscribers.get(author_id)
+                    if subscribers is None:
+                        continue
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[author_id]
+
+    def dispatch(self, event):
+        """Потокобезопасно передаёт событие подписчикам автора."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(event["author"], ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        # Медленный клиент не должен задерживать остальных
+        if not queue.full():
+            queue.put_nowait(event)
+
+
+hub = EventHub()
+
+
+class InProcessBroker:
+    """
+    Доставка событий внутри одного процесса.
+
+    Подходит для разработки и для запуска единственного ASGI-процесса,
+    который сам же и создаёт рецепты.
+    """
+
+    def __init__(self):
+        self._dispatch = None
+
+    def publish(self, event):
+        if self._dispatch is not None:
+            self._dispatch(event)
+
+    def start(self, dispatch):
+        self._dispatch = dispatch
+
+
+class PostgresBroker:
+    """
+    Доставка событий между процессами через LISTEN/NOTIFY PostgreSQL.
+
+    Публикация выполняется через обычное соединение Django, а каждый
+    ASGI-процесс слушает канал в отдельном потоке.
+    """
+
+    channel = "foodgram_recipes"
+    poll_timeout = 5
+    reconnect_delay = 1
+
+    def __init__(self):
+        self._thread = None
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", [self.channel, json.dumps(event)]
+            )
+
+    def start(self, dispatch):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._listen, args=(dispatch,),
+            name="recipe-events", daemon=True
+        )
+        self._thread.start()
+
+    def _listen(self, dispatch):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        while True:
+            try:
+                conn = psycopg2.connect(**connection.get_connection_params())
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select(
+                            [conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception("Recipe events listener failed, reconnecting")
+                time.sleep(self.reconnect_delay)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.RECIPE_EVENTS_BROKER)()
+        return _broker
+
+
+def start_listening():
+    """Подключает ``hub`` текущего процесса к брокеру."""
+    get_broker().start(hub.dispatch)
+
+
+def publish_recipe(recipe):
+    get_broker().publish({
+        "id": recipe.id,
+        "author": recipe.author_id,
+        "name": recipe.name,
+    })
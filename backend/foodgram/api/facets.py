@@ -0,0 +1,165 @@
+"""
+Фасеты списка рецептов: число рецептов по диапазонам времени
+приготовления, по самым частым ингредиентам и по авторам.
+
+Каждый фасет считается одним агрегирующим запросом по отфильтрованному
+набору рецептов. Результат кэшируется по нормализованному набору
+фильтров и версиям тегов рецептов, ингредиентов и пользователей
+(api.cache), поэтому любое изменение этих данных его сбрасывает. Для
+фильтров по ингредиентам в ключ входит и версия индекса ингредиентов
+(recipes.indexes), которая меняется независимо от тегов.
+Списки «моё избранное» и «мой список покупок» зависят от действий
+пользователя, которые версии тегов не меняют, и не кэшируются.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+
+from recipes.indexes import get_index_version
+from recipes.models import RecipeIngredient
+from .cache import INGREDIENTS_TAG, RECIPES_TAG, USERS_TAG, get_versions
+
+FACETS = ('cooking_time', 'ingredients', 'author')
+# Название диапазона, нижняя граница включительно, верхняя — нет
+COOKING_TIME_BUCKETS = (
+    ('0-15', None, 15),
+    ('15-30', 15, 30),
+    ('30-60', 30, 60),
+    ('60+', 60, None),
+)
+FACET_SIZE = 10
+FACETS_CACHE_TIMEOUT = 60 * 60
+KEY_PREFIX = 'recipes:facets:'
+# Параметры, которые не меняют набор рецептов
+NON_FILTER_PARAMS = ('page', 'limit', 'ordering', 'facets', 'view',
+                     'fields', 'omit', 'sideload')
+PERSONAL_PARAMS = ('is_favorited', 'is_in_shopping_cart')
+INGREDIENT_PARAMS = ('ingredients', 'exclude_ingredients')
+
+
+def get_facet_names(query_params):
+    """Запрошенные фасеты из параметра ``facets``."""
+    value = query_params.get('facets')
+    if not value:
+        return ()
+    names = tuple(dict.fromkeys(name.strip() for name in value.split(',')))
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValidationError({'facets': (
+            f'Неизвестные фасеты: {", ".join(unknown)}. '
+            f'Доступны: {", ".join(FACETS)}.'
+        )})
+    return names
+
+
+def get_filters_key(query_params):
+    """
+    Нормализованный набор фильтров: параметры и значения списков
+    через запятую упорядочены, повторы убраны.
+    """
+    items = sorted(
+        (name, ','.join(sorted(set(value.split(',')))))
+        for name, value in query_params.items()
+        if name not in NON_FILTER_PARAMS and value
+    )
+    return urlencode(items)
+
+
+def cooking_time_facet(queryset):
+    buckets = {}
+    for label, start, end in COOKING_TIME_BUCKETS:
+        condition = Q()
+        if start is not None:
+            condition &= Q(cooking_time__gte=start)
+        if end is not None:
+            condition &= Q(cooking_time__lt=end)
+        buckets[label] = Count('pk', filter=condition)
+    counts = queryset.aggregate(**buckets)
+    return [
+        {'value': label, 'count': counts[label]}
+        for label, *_ in COOKING_TIME_BUCKETS
+    ]
+
+
+def ingredients_facet(queryset):
+    rows = RecipeIngredient.objects.filter(
+        recipe__in=queryset.values('pk')
+    ).values(
+        'ingredient_id', 'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        count=Count('recipe_id')
+    ).order_by('-count', 'ingredient_id')[:FACET_SIZE]
+    return [
+        {
+            'id': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+            'count': row['count'],
+        }
+        for row in rows
+    ]
+
+
+def author_facet(queryset):
+    rows = queryset.values('author_id', 'author__username').annotate(
+        count=Count('pk')
+    ).order_by('-count', 'author_id')[:FACET_SIZE]
+    return [
+        {
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'count': row['count'],
+        }
+        for row in rows
+    ]
+
+
+FACET_FUNCTIONS = {
+    'cooking_time': cooking_time_facet,
+    'ingredients': ingredients_facet,
+    'author': author_facet,
+}
+
+
+def get_facets(queryset, names, query_params):
+    """Фасеты ``names`` для отфильтрованного набора рецептов."""
+    queryset = queryset.order_by()
+    personal = any(query_params.get(name) for name in PERSONAL_PARAMS)
+    if personal:
+        return {name: FACET_FUNCTIONS[name](queryset) for name in names}
+
+    versions = get_versions([RECIPES_TAG, INGREDIENTS_TAG, USERS_TAG])
+    digest = hashlib.sha1(
+        get_filters_key(query_params).encode()).hexdigest()
+    version = ':'.join(str(value) for value in versions.values())
+    if any(query_params.get(name) for name in INGREDIENT_PARAMS):
+        version += f':{get_index_version()}'
+    keys = {name: f'{KEY_PREFIX}{name}:{digest}:{version}' for name in names}
+    facets = cache.get_many(list(keys.values()))
+    result, missing = {}, {}
+    for name, key in keys.items():
+        if key in facets:
+            result[name] = facets[key]
+        else:
+            result[name] = missing[key] = FACET_FUNCTIONS[name](queryset)
+    if missing:
+        cache.set_many(missing, FACETS_CACHE_TIMEOUT)
+    return result
+
+
+class FacetListMixin:
+    """Добавляет к списку фасеты, запрошенные параметром ``facets``."""
+
+    def list(self, request, *args, **kwargs):
+        facet_names = get_facet_names(request.query_params)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        if facet_names:
+            response.data['facets'] = get_facets(
+                queryset, facet_names, request.query_params)
+        return response
@@ -0,0 +1,102 @@
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from recipes.indexes import filter_by_ingredients
+from recipes.models import Recipe
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+    """
+    Сортировка рецептов с поддержкой псевдонима ``popular``.
+
+    ``?ordering=popular`` сортирует по убыванию рейтинга популярности,
+    ``?ordering=-popular`` — по возрастанию.
+    """
+    aliases = {
+        'popular': '-popularity',
+        '-popular': 'popularity',
+    }
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if params:
+            fields = [
+                self.aliases.get(param.strip(), param.strip())
+                for param in params.split(',')
+            ]
+            ordering = self.remove_invalid_fields(
+                queryset, fields, view, request)
+            if ordering:
+                return ordering
+        return self.get_default_ordering(view)
+
+
+class IngredientFilterBackend(filters.BaseFilterBackend):
+    """
+    Фильтр рецептов по ингредиентам.
+
+    ``?ingredients=1,2`` — рецепты со всеми ингредиентами из списка
+    (с любым при ``?ingredients_mode=any``),
+    ``?exclude_ingredients=3,4`` — рецепты без этих ингредиентов.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        include = self.get_ids(request, 'ingredients')
+        exclude = self.get_ids(request, 'exclude_ingredients')
+        if not include and not exclude:
+            return queryset
+        match_any = request.query_params.get('ingredients_mode') == 'any'
+        return filter_by_ingredients(queryset, include, match_any, exclude)
+
+    @staticmethod
+    def get_ids(request, param):
+        value = request.query_params.get(param)
+        if not value:
+            return []
+        try:
+            return list(dict.fromkeys(int(pk) for pk in value.split(',')))
+        except ValueError:
+            raise ValidationError(
+                {param: 'Ожидается список id ингредиентов через запятую.'})
+
+
+class NumberInFilter(django_filters.BaseInFilter,
+                     django_filters.NumberFilter):
+    pass
+
+
+class RecipeFilter(django_filters.FilterSet):
+    """
+    Фильтры списка рецептов.
+
+    ``?author=1,2`` — рецепты любого из авторов,
+    ``?cooking_time_min=10&cooking_time_max=30`` — время приготовления
+    в пределах (включительно), ``?is_favorited=1`` и
+    ``?is_in_shopping_cart=1`` — рецепты из избранного и списка покупок
+    пользователя (анонимному — пустой список).
+    """
+    author = NumberInFilter(field_name='author_id')
+    cooking_time = django_filters.RangeFilter()
+    is_favorited = django_filters.NumberFilter(method='filter_user_link')
+    is_in_shopping_cart = django_filters.NumberFilter(
+        method='filter_user_link')
+
+    # Связь пользователя с рецептом для фильтров по флагам
+    user_links = {
+        'is_favorited': 'favorites__user',
+        'is_in_shopping_cart': 'shopping_cart__user',
+    }
+
+    class Meta:
+        model = Recipe
+        fields = ('author', 'cooking_time', 'is_favorited',
+                  'is_in_shopping_cart')
+
+    def filter_user_link(self, queryset, name, value):
+        if value != 1:
+            return queryset
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(**{self.user_links[name]: user})
@@ -0,0 +1,53 @@
+"""
+Кэш представлений рецептов, не зависящих от пользователя.
+
+Для всех пользователей рецепт выглядит одинаково, кроме флагов
+is_favorited, is_in_shopping_cart и author.is_subscribed. Общая часть
+хранится в кэше процесса под ключом из версий рецепта, его автора и
+справочника ингредиентов, а флаги накладываются при каждом ответе.
+"""
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+
+from .cache import (INGREDIENTS_TAG, LRUCache, get_versions, recipe_tag,
+                    user_tag)
+
+recipe_fragments = LRUCache(maxsize=settings.RECIPE_FRAGMENT_CACHE_SIZE)
+
+
+def recipe_tags(recipe):
+    return (recipe_tag(recipe.pk), user_tag(recipe.author_id), INGREDIENTS_TAG)
+
+
+def get_recipe_fragments(
+    recipes, build, prefix='',
+    prefetch=('author', 'recipe_ingredients__ingredient'),
+):
+    """
+    Возвращает {id рецепта: представление}, собирая недостающие
+    представления функцией ``build``.
+
+    Связи ``prefetch`` загружаются только для рецептов, которых нет
+    в кэше. Разные наборы полей должны отличаться ``prefix``.
+    """
+    tags = {tag for recipe in recipes for tag in recipe_tags(recipe)}
+    versions = get_versions(sorted(tags))
+    fragments = {}
+    missing = []
+    for recipe in recipes:
+        key = (prefix, recipe.pk) + tuple(
+            versions[tag] for tag in recipe_tags(recipe))
+        fragment = recipe_fragments.get(key)
+        if fragment is None:
+            missing.append((key, recipe))
+        else:
+            fragments[recipe.pk] = fragment
+
+    if missing:
+        prefetch_related_objects(
+            [recipe for _, recipe in missing], *prefetch)
+        for key, recipe in missing:
+            fragment = build(recipe)
+            recipe_fragments.set(key, fragment)
+            fragments[recipe.pk] = fragment
+    return fragments
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import RecipeSerializer
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время рендеринга страницы списка рецептов "
+        "стандартным JSONRenderer и FastJSONRenderer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=50,
+            help="Количество рецептов на странице.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=200,
+            help="Количество повторов рендеринга.",
+        )
+
+    def handle(self, *args, **options):
+        recipes = list(Recipe.objects.all()[:options["limit"]])
+        if not recipes:
+            self.stdout.write(self.style.WARNING("В базе нет рецептов"))
+            return
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                "orjson не установлен, FastJSONRenderer использует "
+                "стандартный рендерер"))
+
+        page = {
+            "count": len(recipes),
+            "next": None,
+            "previous": None,
+            "results": RecipeSerializer(recipes, many=True).data,
+        }
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                content = renderer.render(page, "application/json")
+            elapsed = (time.perf_counter() - started) / options["repeat"]
+            self.stdout.write(
+                f"{type(renderer).__name__}: {elapsed * 1000:.3f} мс, "
+                f"{len(content)} байт"
+            )
@@ -0,0 +1,126 @@
+"""
+Сжатие ответов gzip или brotli по заголовку Accept-Encoding.
+
+Сжимаются только ответы из списка типов COMPRESSION_CONTENT_TYPES
+размером от COMPRESSION_MIN_SIZE байт, потоковые ответы сжимаются по
+частям. Тела ответов из кэша (api.response_cache) сжимаются один раз:
+сжатый результат хранится в кэше процесса по хэшу содержимого.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# Заголовок и контрольная сумма формата gzip
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Максимальное качество brotli слишком медленное для динамических ответов
+BROTLI_QUALITY = 5
+
+compressed_bodies = LRUCache(maxsize=settings.COMPRESSED_BODY_CACHE_SIZE)
+
+
+def get_encodings():
+    """Доступные кодировки в порядке предпочтения."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """Выбирает кодировку из заголовка Accept-Encoding или None."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding.strip().lower()] = weight
+    for encoding in get_encodings():
+        if weights.get(encoding, weights.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Сжимает поток, отдавая каждую часть сразу после получения."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip()
+    return (
+        not response.has_header('Content-Encoding')
+        and content_type.startswith(settings.COMPRESSION_CONTENT_TYPES)
+    )
+
+
+class CompressionMiddleware(MiddlewareMixin):
+
+    def process_response(self, request, response):
+        if not is_compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            content = self.compress_content(response, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # Сжатое тело отличается от исходного побайтно
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_content(response, encoding):
+        digest = getattr(response, 'content_digest', None)
+        if digest is None:
+            return compress(response.content, encoding)
+        key = (digest, encoding)
+        content = compressed_bodies.get(key)
+        if content is None:
+            content = compress(response.content, encoding)
+            compressed_bodies.set(key, content)
+        return content
@@ -1,7 +1,125 @@
-from rest_framework.pagination import PageNumberPagination 
+"""
+Пагинация списков.
+
+CachedCountPagination не считает точное число объектов большого
+списка на каждый запрос: число для неотфильтрованной большой таблицы
+берётся из статистики планировщика PostgreSQL (pg_class.reltuples),
+а число большого отфильтрованного списка кэшируется на короткое время
+по SQL его запроса. Небольшие списки всегда считаются точно. Ответ
+содержит признак ``count_is_estimate``.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
                                        
 
 class StandardPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6 
-    max_page_size = 50
\ No newline at end of file
+    max_page_size = 50
+
+
+class FeedPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 50
+    # id различает записи с одинаковой датой публикации
+    ordering = ('-pub_date', '-id')
+
+
+def get_table_estimate(queryset):
+    """Оценка числа строк таблицы модели или None вне PostgreSQL."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # -1 — таблица ещё ни разу не анализировалась
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.distinct and not query.combinator
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator с приблизительным и кэшируемым числом объектов."""
+
+    # С какого размера список считается большим
+    exact_count_limit = 1000
+    count_cache_timeout = 30
+    key_prefix = 'pagination:count:'
+
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return len(queryset)
+
+        if is_unfiltered(queryset):
+            estimate = get_table_estimate(queryset)
+            if estimate is not None and estimate >= self.exact_count_limit:
+                self.count_is_estimate = True
+                return estimate
+
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = self.key_prefix + hashlib.sha1(
+            f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is not None:
+            self.count_is_estimate = True
+            return count
+        count = queryset.count()
+        if count >= self.exact_count_limit:
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def validate_number(self, number):
+        # Приблизительное число (признак известен после подсчёта)
+        # не ограничивает номер страницы
+        self.count
+        if not self.count_is_estimate:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы должен быть целым числом.')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1.')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if not self.count_is_estimate and top + self.orphans >= self.count:
+            top = self.count
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+
+class CachedCountPagination(StandardPagination):
+    django_paginator_class = CachedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_estimate'] = (
+            self.page.paginator.count_is_estimate)
+        return response
@@ -0,0 +1,35 @@
+"""
+Быстрый JSON-рендерер на orjson.
+
+Если orjson не установлен или запрошен ответ с отступами, используется
+стандартный рендерер DRF. Значения, которые orjson не сериализует сам
+(Decimal, ленивые строки переводов), а также даты и время передаются
+JSONEncoder DRF, поэтому ответы совпадают с ответами стандартного
+рендерера.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if orjson is None or self.get_indent(
+                accepted_media_type, renderer_context):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return orjson.dumps(
+            data,
+            default=_encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
@@ -0,0 +1,156 @@
+"""
+Кэш готовых ответов для анонимных GET-запросов.
+
+Записи хранятся в двух уровнях: в кэше процесса и в кэше Django. С общим
+бэкендом (memcached в docker-compose) все воркеры gunicorn видят одни и
+те же ответы; с кэшем в памяти процесса, который используется по
+умолчанию, второй уровень у каждого процесса свой. Каждый ответ
+помечается тегами данных, из которых он собран (``recipe:5``,
+``user:3``, ``recipes``...), вместе с их версиями на момент сборки.
+Изменение модели меняет версии её тегов (api.signals), и при следующем
+чтении такая запись считается устаревшей.
+"""
+import hashlib
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .cache import LRUCache, get_versions
+
+KEY_PREFIX = 'response:'
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Vary')
+
+
+class ResponseCache:
+
+    def __init__(self, maxsize, local_ttl, shared_ttl):
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self.shared_ttl = shared_ttl
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is None:
+            entry = cache.get(KEY_PREFIX + key)
+            if entry is None:
+                return None
+            self.local.set(key, entry)
+        tags = entry['tags']
+        if get_versions(list(tags)) != tags:
+            self.local.delete(key)
+            return None
+        return entry
+
+    def set(self, key, response, tags):
+        entry = {
+            'content': response.content,
+            # По хэшу api.middleware находит уже сжатое тело
+            'digest': hashlib.sha1(response.content).hexdigest(),
+            'status': response.status_code,
+            'content_type': response['Content-Type'],
+            'headers': {
+                header: response[header]
+                for header in CACHED_HEADERS if response.has_header(header)
+            },
+            'tags': get_versions(sorted(set(tags))),
+        }
+        self.local.set(key, entry)
+        cache.set(KEY_PREFIX + key, entry, self.shared_ttl)
+        return entry
+
+    def clear(self):
+        self.local.clear()
+
+
+response_cache = ResponseCache(
+    maxsize=settings.RESPONSE_CACHE_SIZE,
+    local_ttl=settings.RESPONSE_CACHE_LOCAL_TTL,
+    shared_ttl=settings.RESPONSE_CACHE_SHARED_TTL,
+)
+
+
+def get_cache_key(request):
+    """
+    Ключ по адресу сайта, пути и упорядоченным параметрам запроса.
+    Адрес нужен, потому что ссылки на картинки в ответах абсолютные.
+    """
+    query = urlencode(sorted(parse_qsl(
+        request.META.get('QUERY_STRING', ''), keep_blank_values=True)))
+    key = '|'.join((
+        request.scheme,
+        request.get_host(),
+        request.path,
+        query,
+        request.META.get('HTTP_ACCEPT', ''),
+    ))
+    # Хэш: ключи memcached ограничены по длине и без пробелов
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def is_anonymous(request):
+    """
+    Анонимность запроса до аутентификации: API принимает только токен
+    в заголовке Authorization (и принудительную аутентификацию DRF
+    в тестах).
+    """
+    return (
+        'HTTP_AUTHORIZATION' not in request.META
+        and getattr(request, '_force_auth_user', None) is None
+    )
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Отдаёт анонимным пользователям готовые ответы из кэша.
+
+    Представление описывает зависимости ответа в ``get_cache_tags``.
+    Кэшируются только действия из ``cached_actions``.
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        key = None
+        if (
+            request.method == 'GET'
+            and is_anonymous(request)
+            and self.action_map.get('get') in self.cached_actions
+        ):
+            key = get_cache_key(request)
+            entry = response_cache.get(key)
+            if entry is not None:
+                return self.get_cached_response(request, entry)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if key is not None and response.status_code == 200:
+            response.render()
+            entry = response_cache.set(
+                key, response, self.get_cache_tags(response))
+            response.content_digest = entry['digest']
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def get_cached_response(self, request, entry):
+        headers = entry['headers']
+        response = get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=parse_http_date_safe(
+                headers.get('Last-Modified', '')),
+        )
+        if response is None:
+            response = HttpResponse(
+                entry['content'],
+                status=entry['status'],
+                content_type=entry['content_type'],
+            )
+            response.content_digest = entry.get('digest')
+        for header, value in headers.items():
+            response[header] = value
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def get_cache_tags(self, response):
+        raise NotImplementedError
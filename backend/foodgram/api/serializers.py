@@ -1,5 +1,10 @@
+from collections import OrderedDict
+
 from rest_framework import serializers, status
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, Manager, OuterRef
 from recipes.models import (
     Ingredient,
     Recipe,
@@ -10,9 +15,30 @@ from recipes.models import (
 )
 from django.contrib.auth.hashers import make_password
 from drf_extra_fields.fields import Base64ImageField
+from recipes import similarity
+from recipes.indexes import bump_index_version
+from .cache import invalidate_recipe
+from .fragments import get_recipe_fragments
 
 User = get_user_model()
 
+MAX_BULK_SIZE = 100
+
+
+def get_viewer(context):
+    """
+    Пользователь, для которого строится ответ, или None.
+
+    При сборке общего для всех пользователей представления рецепта
+    (context["fragment"]) зависящие от пользователя поля не считаются.
+    """
+    if context.get("fragment"):
+        return None
+    request = context.get("request")
+    if request and request.user.is_authenticated:
+        return request.user
+    return None
+
 
 class UserCreateSerializer(serializers.ModelSerializer):
     avatar = Base64ImageField(required=False, allow_null=True)
@@ -131,8 +157,46 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit")
 
 
+class IngredientIdField(serializers.PrimaryKeyRelatedField):
+    """
+    Проверяет только формат id ингредиента. Сами ингредиенты загружает
+    RecipeIngredientListSerializer одним запросом на весь список.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {item["ingredient"] for item in items})
+        message = self.child.fields["id"].error_messages["does_not_exist"]
+        errors = []
+        for item in items:
+            ingredient = ingredients.get(item["ingredient"])
+            if ingredient is None:
+                errors.append({"id": [serializers.ErrorDetail(
+                    message.format(pk_value=item["ingredient"]),
+                    code="does_not_exist",
+                )]})
+                continue
+            item["ingredient"] = ingredient
+            errors.append({})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = IngredientIdField(
         queryset=Ingredient.objects.all(), source="ingredient"
     )
     name = serializers.StringRelatedField(
@@ -148,6 +212,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeIngredient
         fields = ("id", "name", "measurement_unit", "amount")
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class AuthorSerializer(serializers.ModelSerializer):
@@ -167,9 +232,9 @@ class AuthorSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get("request")
-        if request and request.user.is_authenticated:
-            return request.user.follower.filter(author=obj).exists()
+        viewer = get_viewer(self.context)
+        if viewer is not None:
+            return viewer.follower.filter(author=obj).exists()
         return False
 
     def get_avatar(self, obj):
@@ -178,6 +243,75 @@ class AuthorSerializer(serializers.ModelSerializer):
         return None
 
 
+# Поля рецепта, зависящие от пользователя
+VIEWER_FIELDS = frozenset(("author", "is_favorited", "is_in_shopping_cart"))
+
+RECIPE_VIEWS = {
+    "card": (
+        "id",
+        "author",
+        "image",
+        "name",
+        "cooking_time",
+        "is_favorited",
+        "is_in_shopping_cart",
+    ),
+}
+
+
+def get_recipe_shape(query_params):
+    """
+    Набор полей рецепта из параметров ``view``, ``fields`` и ``omit``
+    или None, если нужны все поля. Поле id возвращается всегда.
+    """
+    names = RecipeSerializer.Meta.fields
+    view = query_params.get("view")
+    if view in RECIPE_VIEWS:
+        names = RECIPE_VIEWS[view]
+    if query_params.get("fields"):
+        selected = set(query_params["fields"].split(","))
+        names = tuple(name for name in names if name in selected)
+    if query_params.get("omit"):
+        omitted = set(query_params["omit"].split(","))
+        names = tuple(name for name in names if name not in omitted)
+    if "id" not in names:
+        names = ("id",) + names
+    if names == RecipeSerializer.Meta.fields:
+        return None
+    return names
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        result = self.child.to_representation_many(list(recipes))
+        if "authors" in self.context.get("sideload", ()):
+            result = self.sideload_authors(result)
+        return result
+
+    def sideload_authors(self, result):
+        """
+        Заменяет вложенных авторов на author_id и собирает каждого автора
+        один раз в словарь ``self.authors``.
+        """
+        self.authors = {}
+        compact = []
+        for data in result:
+            if "author" not in data:
+                compact.append(data)
+                continue
+            item = OrderedDict()
+            for name, value in data.items():
+                if name == "author":
+                    item["author_id"] = value["id"]
+                    self.authors.setdefault(value["id"], value)
+                else:
+                    item[name] = value
+            compact.append(item)
+        return compact
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
@@ -204,6 +338,15 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_favorited",
             "is_in_shopping_cart",
         )
+        list_serializer_class = RecipeListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        shape = self.context.get("fields")
+        if shape is None:
+            return fields
+        return OrderedDict(
+            (name, field) for name, field in fields.items() if name in shape)
 
     def validate_image(self, value):
         if not value:
@@ -226,17 +369,76 @@ class RecipeSerializer(serializers.ModelSerializer):
         return data
 
     def get_is_favorited(self, obj):
-        request = self.context.get("request")
-        if request and request.user.is_authenticated:
-            return obj.favorites.filter(user=request.user).exists()
+        viewer = get_viewer(self.context)
+        if viewer is not None:
+            return obj.favorites.filter(user=viewer).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get("request")
-        if request and request.user.is_authenticated:
-            return obj.shopping_cart.filter(user=request.user).exists()
+        viewer = get_viewer(self.context)
+        if viewer is not None:
+            return obj.shopping_cart.filter(user=viewer).exists()
         return False
 
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, recipes):
+        """
+        Представления рецептов: общая часть берётся из кэша, флаги
+        пользователя накладываются одним запросом на все рецепты.
+        """
+        request = self.context.get("request")
+        names = tuple(self.fields)
+        fragment_serializer = RecipeSerializer(
+            context={**self.context, "fragment": True})
+        prefetch = []
+        if "author" in names:
+            prefetch.append("author")
+        if "ingredients" in names:
+            prefetch.append("recipe_ingredients__ingredient")
+        fragments = get_recipe_fragments(
+            recipes,
+            super(RecipeSerializer, fragment_serializer).to_representation,
+            prefix="{}|{}".format(
+                request.build_absolute_uri("/") if request else "",
+                ",".join(names),
+            ),
+            prefetch=prefetch,
+        )
+        flags = self.get_viewer_flags(recipes, names)
+        result = []
+        for recipe in recipes:
+            data = OrderedDict(fragments[recipe.pk])
+            favorited, in_shopping_cart, subscribed = flags.get(
+                recipe.pk, (False, False, False))
+            if "is_favorited" in data:
+                data["is_favorited"] = favorited
+            if "is_in_shopping_cart" in data:
+                data["is_in_shopping_cart"] = in_shopping_cart
+            if "author" in data:
+                data["author"] = OrderedDict(data["author"])
+                data["author"]["is_subscribed"] = subscribed
+            result.append(data)
+        return result
+
+    def get_viewer_flags(self, recipes, names=VIEWER_FIELDS):
+        """{id рецепта: (в избранном, в списке покупок, подписан на автора)}"""
+        viewer = get_viewer(self.context)
+        if viewer is None or not recipes or VIEWER_FIELDS.isdisjoint(names):
+            return {}
+        rows = Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes]
+        ).order_by().annotate(
+            favorited=Exists(Favorite.objects.filter(
+                user=viewer, recipe=OuterRef("pk"))),
+            in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=viewer, recipe=OuterRef("pk"))),
+            subscribed=Exists(Subscription.objects.filter(
+                user=viewer, author=OuterRef("author"))),
+        ).values_list("pk", "favorited", "in_shopping_cart", "subscribed")
+        return {pk: tuple(flags) for pk, *flags in rows}
+
     def _save_ingredients(self, recipe, ingredients):
         objs = []
         for item in ingredients:
@@ -250,15 +452,65 @@ class RecipeSerializer(serializers.ModelSerializer):
                 )
             )
         RecipeIngredient.objects.bulk_create(objs)
+        bump_index_version()
+        similarity.schedule_update(recipe.pk)
+
+    def _update_ingredients(self, recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к переданным, меняя только
+        отличающиеся строки: не больше одного запроса на выборку,
+        удаление, обновление и добавление.
+        """
+        existing = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        amounts = {
+            item["ingredient"].id: item["amount"] for item in ingredients
+        }
 
+        to_delete = [
+            item.pk for ingredient_id, item in existing.items()
+            if ingredient_id not in amounts
+        ]
+        to_update = []
+        for ingredient_id, item in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                to_update.append(item)
+        to_create = [
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+
+        if to_delete:
+            RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ["amount"])
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        changed = bool(to_delete or to_update or to_create)
+        if changed:
+            # Количества хранит матрица подбора recipes.indexes.recipe_matrix
+            bump_index_version()
+        if to_delete or to_create:
+            similarity.schedule_update(recipe.pk)
+        return changed
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("recipe_ingredients")
         recipe = Recipe(**validated_data)
         recipe.full_clean()
         recipe.save()
         self._save_ingredients(recipe, ingredients_data)
+        invalidate_recipe(recipe.pk)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop("recipe_ingredients", None)
         for attr, value in validated_data.items():
@@ -267,9 +519,9 @@ class RecipeSerializer(serializers.ModelSerializer):
         instance.full_clean()
         instance.save()
 
-        if ingredients_data is not None:
-            instance.recipe_ingredients.all().delete()
-            self._save_ingredients(instance, ingredients_data)
+        if ingredients_data is not None and self._update_ingredients(
+                instance, ingredients_data):
+            invalidate_recipe(instance.pk)
 
         return instance
 
@@ -292,6 +544,69 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         fields = ("user", "recipe")
 
 
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для массовых операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_SIZE,
+    )
+
+    def validate_ids(self, value):
+        # Повторы убираются с сохранением порядка
+        return list(dict.fromkeys(value))
+
+
+class PantryItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    amount = serializers.IntegerField(
+        min_value=MIN_VALUE_POSITIVE_SMALL_INT, required=False)
+
+
+class PantrySerializer(serializers.Serializer):
+    """Продукты пользователя для подбора рецептов."""
+    ingredients = PantryItemSerializer(many=True, allow_empty=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    min_coverage = serializers.FloatField(
+        min_value=0, max_value=1, default=0)
+
+    def validate_ingredients(self, value):
+        # Количество не указано — продукта достаточно
+        return {item["id"]: item.get("amount") for item in value}
+
+
+class BatchItemSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        choices=("GET", "POST", "PUT", "PATCH", "DELETE"))
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and isinstance(data.get("method"), str):
+            data = {**data, "method": data["method"].upper()}
+        return super().to_internal_value(data)
+
+    def validate_path(self, value):
+        if not value.startswith("/api/") or value.startswith(
+                self.context.get("batch_path", "/api/batch/")):
+            raise serializers.ValidationError(
+                "Допустимы только пути API, кроме самого пакетного запроса."
+            )
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f"Не больше {settings.BATCH_MAX_REQUESTS} запросов в пакете."
+            )
+        return value
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -332,16 +647,27 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         # Проверка, подписан ли текущий пользователь на автора
         request = self.context.get("request")
         if request and request.user.is_authenticated:
+            if obj.user_id == request.user.id:
+                # Это подписка самого пользователя
+                return True
             return obj.author.following.filter(user=request.user).exists()
         return False
 
     def get_recipes(self, obj):
-        request = self.context.get("request")
-        limit = request.query_params.get("recipes_limit")
-        queryset = obj.author.recipes.all()
-        if limit:
-            queryset = queryset[: int(limit)]
+        # Рецепты, заранее выбранные для всей страницы одним запросом
+        recipes_by_author = self.context.get("recipes_by_author")
+        if recipes_by_author is not None:
+            queryset = recipes_by_author.get(obj.author_id, [])
+        else:
+            request = self.context.get("request")
+            limit = request.query_params.get("recipes_limit")
+            queryset = obj.author.recipes.all()
+            if limit:
+                queryset = queryset[: int(limit)]
         return ShortRecipeSerializer(queryset, many=True).data
 
     def get_recipes_count(self, obj):
+        recipes_count = getattr(obj, "recipes_count", None)
+        if recipes_count is not None:
+            return recipes_count
         return obj.author.recipes.count()
@@ -0,0 +1,178 @@
+"""
+Короткие ссылки на рецепты: /s/<code> → /recipes/<id>.
+
+Код — base62-запись перемешанного id рецепта: разные рецепты всегда
+получают разные коды, а ссылка на рецепт создаётся один раз
+(ShortLink.recipe уникален). Код переводится в адрес рецепта через кэш
+процесса, поэтому повторные переходы не обращаются к базе; удаление
+рецепта убирает его код из кэша.
+
+Переходы копятся в памяти процесса, и фоновый поток записывает их одним
+UPDATE раз в SHORT_LINK_FLUSH_INTERVAL секунд или раньше, когда их
+набирается SHORT_LINK_FLUSH_SIZE, а также при завершении процесса.
+Запрос перехода в базу не пишет.
+"""
+import atexit
+import logging
+import string
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, Value, When
+from django.http import Http404, HttpResponseRedirect
+
+from recipes.models import ShortLink
+from .cache import LRUCache
+
+ALPHABET = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+# Умножение на число, взаимно простое с 62, переставляет все
+# CODE_LENGTH-значные коды
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+CODE_MULTIPLIER = 14_348_907
+# Адрес рецепта во фронтенде
+RECIPE_URL = '/recipes/{}'
+
+logger = logging.getLogger(__name__)
+
+resolved_links = LRUCache(
+    maxsize=settings.SHORT_LINK_CACHE_SIZE,
+    ttl=settings.SHORT_LINK_CACHE_TTL,
+)
+
+
+def encode(number, length=0):
+    """Запись числа в base62, дополненная нулями до ``length``."""
+    digits = []
+    while number:
+        number, digit = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return ''.join(reversed(digits)).rjust(length, ALPHABET[0])
+
+
+def make_code(recipe_id):
+    if recipe_id < CODE_SPACE:
+        return encode(recipe_id * CODE_MULTIPLIER % CODE_SPACE, CODE_LENGTH)
+    # Такие id дают коды длиннее CODE_LENGTH и не пересекаются с короткими
+    return encode(recipe_id)
+
+
+def get_short_link(recipe_id):
+    """Короткая ссылка рецепта, создаётся при первом запросе."""
+    try:
+        with transaction.atomic():
+            link, _ = ShortLink.objects.get_or_create(
+                recipe_id=recipe_id,
+                defaults={'code': make_code(recipe_id)},
+            )
+    except IntegrityError:
+        # Ссылку одновременно создал другой запрос
+        link = ShortLink.objects.get(recipe_id=recipe_id)
+    return link
+
+
+class ClickBuffer:
+    """
+    Счётчики переходов в памяти процесса, которые записывает в базу
+    фоновый поток.
+    """
+
+    def __init__(self, flush_size, flush_interval):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._counts = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, link_id):
+        with self._lock:
+            self._counts[link_id] += 1
+            self._pending += 1
+            due = self._pending >= self.flush_size
+        self.start()
+        if due:
+            self._wake.set()
+
+    def start(self):
+        """Запускает фоновую запись, если она не запущена в этом процессе."""
+        if not getattr(settings, 'SHORT_LINK_FLUSH_ASYNC', True):
+            return
+        with self._lock:
+            # После fork поток родителя в дочернем процессе не работает
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='short-link-clicks', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Short link clicks flush failed')
+            finally:
+                # Соединение фонового потока не должно оставаться открытым
+                connection.close()
+
+    def flush(self):
+        """Записывает накопленные переходы одним запросом."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending = 0
+        if not counts:
+            return 0
+        try:
+            ShortLink.objects.filter(pk__in=counts).update(
+                clicks=F('clicks') + Case(
+                    *(When(pk=pk, then=Value(count))
+                      for pk, count in counts.items()),
+                    default=Value(0),
+                )
+            )
+        except Exception:
+            # Незаписанные переходы уйдут со следующей записью
+            with self._lock:
+                self._counts.update(counts)
+                self._pending += sum(counts.values())
+            raise
+        return sum(counts.values())
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._pending = 0
+
+
+click_buffer = ClickBuffer(
+    flush_size=settings.SHORT_LINK_FLUSH_SIZE,
+    flush_interval=settings.SHORT_LINK_FLUSH_INTERVAL,
+)
+atexit.register(click_buffer.flush)
+
+
+def resolve(code):
+    """(id ссылки, id рецепта) по коду или None."""
+    link = resolved_links.get(code)
+    if link is None:
+        link = ShortLink.objects.filter(code=code).values_list(
+            'id', 'recipe_id').first()
+        if link is None:
+            return None
+        resolved_links.set(code, link)
+    return link
+
+
+def short_link_redirect(request, code):
+    link = resolve(code)
+    if link is None:
+        raise Http404
+    link_id, recipe_id = link
+    click_buffer.add(link_id)
+    return HttpResponseRedirect(RECIPE_URL.format(recipe_id))
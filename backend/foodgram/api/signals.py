@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from .authentication import invalidate_token, invalidate_user_tokens
+from .cache import (INGREDIENTS_TAG, invalidate, invalidate_recipe,
+                    invalidate_user)
+from .events import publish_recipe
+from .shortlinks import make_code, resolved_links
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def publish_new_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: publish_recipe(instance))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens_on_save(sender, instance, raw=False, **kwargs):
+    # Смена пароля, блокировка и правка профиля
+    if not raw:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    # Выход пользователя (token/logout/) удаляет его токен
+    invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_cache(sender, instance, **kwargs):
+    invalidate_recipe(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    # Код ссылки однозначно задан id рецепта
+    resolved_links.delete(make_code(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredients_cache(sender, instance, **kwargs):
+    invalidate_recipe(instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, update_fields=None, **kwargs):
+    # Время последнего входа нигде не отдаётся, вход не сбрасывает кэш
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    # Профиль и аватар автора входят в представление его рецептов
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients_cache(sender, instance, **kwargs):
+    invalidate(INGREDIENTS_TAG)
@@ -0,0 +1,117 @@
+"""
+ASGI-приложение для потока Server-Sent Events о новых рецептах.
+
+Открытое соединение ничего не стоит, пока нет событий: вместо опроса
+/api/recipes/ клиент получает новые рецепты авторов из своих подписок.
+Аутентификация — тот же токен, что и для REST API: заголовок
+``Authorization: Token <key>`` или параметр ``?token=<key>`` (EventSource
+в браузере не умеет передавать заголовки).
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Subscription
+from .events import hub, start_listening
+
+STREAM_PATH = '/api/recipes/stream/'
+KEEPALIVE_INTERVAL = 15
+
+
+def _get_token_key(scope):
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            if keyword == 'Token' and key:
+                return key.strip()
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    return query.get('token', [None])[0]
+
+
+@sync_to_async
+def _get_followed_authors(token_key):
+    """Возвращает id авторов из подписок или None для чужого токена."""
+    token = Token.objects.select_related('user').filter(
+        key=token_key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return set(Subscription.objects.filter(
+        user_id=token.user_id).values_list('author_id', flat=True))
+
+
+def format_event(event):
+    return (
+        f'id: {event["id"]}\n'
+        f'event: recipe\n'
+        f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
+    ).encode()
+
+
+async def _send_unauthorized(send):
+    await send({
+        'type': 'http.response.start',
+        'status': 401,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': b'{"detail": "Authentication credentials were not provided."}',
+    })
+
+
+async def recipe_events(scope, receive, send):
+    token_key = _get_token_key(scope)
+    author_ids = await _get_followed_authors(token_key) if token_key else None
+    if author_ids is None:
+        await _send_unauthorized(send)
+        return
+
+    start_listening()
+    with hub.subscribe(author_ids) as queue:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await _stream(queue, disconnected, send)
+        finally:
+            disconnected.cancel()
+
+
+async def _stream(queue, disconnected, send):
+    while not disconnected.done():
+        next_event = asyncio.ensure_future(queue.get())
+        done, _ = await asyncio.wait(
+            {next_event, disconnected},
+            timeout=KEEPALIVE_INTERVAL,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if next_event in done:
+            body = format_event(next_event.result())
+        else:
+            next_event.cancel()
+            if disconnected in done:
+                return
+            # Комментарий не даёт прокси закрыть соединение
+            body = b': keepalive\n\n'
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+            'more_body': True,
+        })
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
@@ -6,6 +6,7 @@ from api.views import (
     RecipeViewSet,
     SubscriptionViewSet
 )
+from api.batch import BatchView
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
@@ -28,6 +29,14 @@ urlpatterns = [
         SubscriptionViewSet.as_view({'post': 'subscribe', 'delete': 'subscribe'}),
         name='subscribe'
     ),
+    path(
+        'users/subscribe/',
+        SubscriptionViewSet.as_view(
+            {'post': 'bulk_subscribe', 'delete': 'bulk_subscribe'}),
+        name='bulk_subscribe'
+    ),
+
+    path('batch/', BatchView.as_view(), name='batch'),
 
     path('', include(router.urls)),
     
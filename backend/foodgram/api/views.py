@@ -1,10 +1,15 @@
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.http import HttpResponse
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum, Window
+from django.db.models.functions import RowNumber
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .pagination import StandardPagination
+from .pagination import (CachedCountPagination, FeedPagination,
+                         StandardPagination)
 from rest_framework.permissions import IsAuthenticated
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
@@ -21,12 +26,25 @@ from recipes.models import (
     ShoppingCart,
     Subscription, Favorite 
 )
+from recipes import timeline
+from recipes import recommendations, similarity
+from recipes.indexes import recipe_matrix
+from recipes.popularity import get_trending_version
 from .serializers import (UserSerializer, UserCreateSerializer,
                           IngredientSerializer,
                           RecipeSerializer, ShortRecipeSerializer,
                           SubscriptionSerializer, SetPasswordSerializer,
-                          AvatarSerializer)
+                          AvatarSerializer, BulkIdsSerializer,
+                          PantrySerializer, RECIPE_VIEWS, get_recipe_shape)
 from .permissions import IsAuthorOrReadOnlyPermission
+from .filters import (IngredientFilterBackend, RecipeFilter,
+                      RecipeOrderingFilter)
+from .cache import (INGREDIENTS_TAG, RECIPES_TAG, USERS_TAG, get_versions,
+                    recipe_tag, user_tag)
+from .conditional import ConditionalGetMixin
+from .facets import FacetListMixin
+from .response_cache import AnonymousResponseCacheMixin
+from .shortlinks import get_short_link
 
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import rest_framework as filtersSearchIngr
@@ -39,9 +57,17 @@ TITLE_OFFSET = 30
 BOTTOM_MARGIN = 50
 FONT_NAME = "CyrillicFont"
 FONT_SIZE = 14
+TRENDING_SIZE = 100
+TRENDING_CACHE_TIMEOUT = 300
+SIMILAR_LIMIT = 6
+SIMILAR_MAX_LIMIT = 20
+SIMILAR_CACHE_TIMEOUT = 60 * 60
+RECOMMENDED_SIZE = 100
+RECOMMENDED_CACHE_TIMEOUT = 60 * 60
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin,
+                  viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
@@ -53,6 +79,11 @@ class UserViewSet(viewsets.ModelViewSet):
             return UserCreateSerializer
         return UserSerializer
 
+    def get_cache_tags(self, response):
+        if self.action == 'retrieve':
+            return [user_tag(response.data['id'])]
+        return [USERS_TAG]
+
     @action(detail=False, methods=['get'], 
             permission_classes=[permissions.IsAuthenticated])
     def me(self, request):
@@ -120,7 +151,8 @@ class IngredientFilter(filtersSearchIngr.FilterSet):
         fields = ['name']
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AnonymousResponseCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
@@ -128,92 +160,187 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     # search_fields = ('name',) 
 
+    def get_cache_tags(self, response):
+        return [INGREDIENTS_TAG]
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    
-    queryset = Recipe.objects.select_related('author').prefetch_related(
-        'recipe_ingredients__ingredient'
-    )
+
+class RecipeViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin,
+                    FacetListMixin, viewsets.ModelViewSet):
+    # Автор и ингредиенты загружаются сериализатором только для рецептов,
+    # которых нет в кэше представлений (api.fragments)
+    queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthorOrReadOnlyPermission]
-    filter_backends = (filters.SearchFilter, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, filters.SearchFilter,
+                       IngredientFilterBackend, RecipeOrderingFilter)
+    filterset_class = RecipeFilter
     search_fields = ('name', 'author__username')
-    ordering_fields = ['pub_date', 'cooking_time']
-    pagination_class = StandardPagination
+    ordering_fields = ['pub_date', 'cooking_time', 'popularity']
+    pagination_class = CachedCountPagination
+    last_modified_fields = ('updated_at', 'author__updated_at')
+    # Создание и удаление рецептов меняют версию тега recipes,
+    # которая входит в ETag списка
+    count_in_etag = False
+    # Действия над одним рецептом загружают только нужные им поля
+    action_only_fields = {
+        'favorite': ('id', 'name', 'image', 'cooking_time'),
+        'shopping_cart': ('id', 'name', 'image', 'cooking_time'),
+        'get_link': ('id',),
+        'destroy': ('id', 'author_id'),
+    }
+
+    def get_recipe_shape(self):
+        """Запрошенный набор полей рецепта (None — все поля)."""
+        if self.request.method not in permissions.SAFE_METHODS:
+            return None
+        return get_recipe_shape(self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_recipe_shape()
+        sideload = self.request.query_params.get('sideload')
+        context['sideload'] = set(sideload.split(',')) if sideload else set()
+        return context
+
+    def get_paginated_response(self, data):
+        # Авторы страницы при ?sideload=authors (RecipeListSerializer)
+        response = super().get_paginated_response(data)
+        authors = getattr(getattr(data, 'serializer', None), 'authors', None)
+        if authors is not None:
+            response.data['authors'] = authors
+        return response
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        user = self.request.user
-        
-        if self.request.query_params.get('is_favorited') == '1':
-            if user.is_authenticated:
-                queryset = queryset.filter(favorites__user=user)
-            else:
-                queryset = queryset.none()
-        
-        if self.request.query_params.get('is_in_shopping_cart') == '1':
-            if user.is_authenticated:
-                queryset = queryset.filter(shopping_cart__user=user)
-            else:
-                queryset = queryset.none()
-        
-        author_id = self.request.query_params.get('author')
-        if author_id:
-            queryset = queryset.filter(author_id=author_id)
-        
+    def shape_queryset(self, queryset):
+        # Текст рецепта — самое большое поле, без него его не загружаем
+        shape = self.get_recipe_shape()
+        if shape is not None and 'text' not in shape:
+            return queryset.defer('text')
         return queryset
 
+    def get_recipes_page_response(self, page_ids):
+        """Ответ со страницей рецептов в порядке ``page_ids``."""
+        recipes = self.shape_queryset(self.queryset).in_bulk(page_ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page_ids if pk in recipes], many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def paginate_ids(self, ids):
+        """Страница рецептов из упорядоченного списка id."""
+        return self.get_recipes_page_response(self.paginate_queryset(ids))
+
+    def get_queryset(self):
+        only_fields = self.action_only_fields.get(self.action)
+        if only_fields is not None:
+            return Recipe.objects.only(*only_fields)
+
+        return self.shape_queryset(super().get_queryset())
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def get_etag_extra(self):
+        # Порядок по популярности меняется при пересчёте рейтинга
+        extra = (get_trending_version(),)
+        if self.action == 'list':
+            extra += (get_versions([RECIPES_TAG])[RECIPES_TAG],)
+        return extra
+
+    def get_cache_tags(self, response):
+        # Без поля author ответ от данных автора не зависит
+        if self.action == 'retrieve':
+            recipes = [response.data]
+            tags = [recipe_tag(response.data['id']), INGREDIENTS_TAG]
+        else:
+            recipes = response.data['results']
+            tags = [RECIPES_TAG, INGREDIENTS_TAG] + [
+                user_tag(author_id)
+                for author_id in response.data.get('authors', ())
+            ]
+            if 'facets' in response.data:
+                tags.append(USERS_TAG)
+        return tags + [
+            user_tag(recipe['author']['id'])
+            for recipe in recipes if 'author' in recipe
+        ]
+
     @action(detail=True, methods=['post', 'delete'], 
             permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, pk=None):
-        recipe = self.get_object()
-        user = request.user
-        if request.method == 'POST':
-            if user.favorites.filter(
-                recipe=recipe).exists():
-                return Response(
-                    {'detail': 'Рецепт уже в избранном.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.create(user=request.user, recipe=recipe)
-            serializer = ShortRecipeSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        
-        deleted_count, _ = user.favorites.filter(recipe=recipe).delete()
-        if deleted_count == 0:
-            return Response(
-                {'detail': 'Рецепта нет в избранном.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self._toggle_user_recipe(
+            request, Favorite,
+            already_added='Рецепт уже в избранном.',
+            not_added='Рецепта нет в избранном.',
+        )
 
     @action(detail=True, methods=['post', 'delete'], 
             permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, pk=None):
+        return self._toggle_user_recipe(
+            request, ShoppingCart,
+            already_added='Рецепт уже в списке покупок.',
+            not_added='Рецепта нет в списке покупок.',
+        )
+
+    def _toggle_user_recipe(self, request, model, already_added, not_added):
+        # Запрос за рецептом и запрос на вставку или удаление связи
         recipe = self.get_object()
-        user = request.user
         if request.method == 'POST':
-            if user.shopping_cart.filter(
-                recipe=recipe).exists():
+            if not model.objects.add(request.user, recipe):
                 return Response(
-                    {'detail': 'Рецепт уже в списке покупок.'},
+                    {'detail': already_added},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
             serializer = ShortRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        
-        deleted_count, _ = user.shopping_cart.filter(recipe=recipe).delete()
+
+        deleted_count, _ = model.objects.filter(
+            user=request.user, recipe=recipe).delete()
         if deleted_count == 0:
             return Response(
-                {'detail': 'Рецепта нет в списке покупок.'},
+                {'detail': not_added},
                 status=status.HTTP_400_BAD_REQUEST
             )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post', 'delete'], url_path='favorite',
+            url_name='bulk-favorite',
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_favorite(self, request):
+        """Добавление или удаление нескольких рецептов из избранного."""
+        return self._bulk_user_recipes(request, Favorite)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', url_name='bulk-shopping-cart',
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_shopping_cart(self, request):
+        """Добавление или удаление нескольких рецептов из списка покупок."""
+        return self._bulk_user_recipes(request, ShoppingCart)
+
+    def _bulk_user_recipes(self, request, model):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = model.objects.add_many(request.user, ids)
+                rest = [pk for pk in ids if pk not in changed]
+                found = set(Recipe.objects.filter(
+                    id__in=rest).values_list('id', flat=True)) if rest else ()
+                results = [
+                    {'id': pk, 'status': 'added' if pk in changed
+                     else 'exists' if pk in found else 'not_found'}
+                    for pk in ids
+                ]
+            else:
+                changed = model.objects.remove_many(request.user, ids)
+                results = [
+                    {'id': pk,
+                     'status': 'removed' if pk in changed else 'not_found'}
+                    for pk in ids
+                ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], 
             permission_classes=[permissions.IsAuthenticated])
     def download_shopping_cart(self, request):
@@ -256,10 +383,142 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
         return response
 
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated],
+            pagination_class=FeedPagination, filter_backends=[])
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь."""
+        entries = request.user.timeline.only('recipe_id', 'pub_date')
+        page = self.paginate_queryset(entries)
+        return self.get_recipes_page_response(
+            [entry.recipe_id for entry in page])
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """
+        Самые популярные рецепты по затухающему во времени рейтингу.
+
+        Список id лучших рецептов кэшируется до следующего пересчёта
+        рейтинга командой update_popularity.
+        """
+        cache_key = f'recipes:trending:{get_trending_version()}'
+        ranked_ids = cache.get(cache_key)
+        if ranked_ids is None:
+            ranked_ids = list(
+                Recipe.objects.filter(popularity__gt=0)
+                .order_by('-popularity', '-pub_date')
+                .values_list('id', flat=True)[:TRENDING_SIZE]
+            )
+            cache.set(cache_key, ranked_ids, TRENDING_CACHE_TIMEOUT)
+        return self.paginate_ids(ranked_ids)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated],
+            filter_backends=[])
+    def recommended(self, request):
+        """
+        Рецепты, которые часто добавляют в избранное вместе с избранными
+        рецептами пользователя (recipes.recommendations).
+
+        Список id кэшируется для пользователя до следующего пересчёта
+        соседей командой build_neighbours; рецепты, добавленные в
+        избранное после этого, из него убираются.
+        """
+        cache_key = (
+            f'recipes:recommended:{request.user.id}:'
+            f'{recommendations.get_version()}'
+        )
+        ranked_ids = cache.get(cache_key)
+        if ranked_ids is None:
+            ranked_ids = recommendations.recommend(
+                request.user, RECOMMENDED_SIZE)
+            cache.set(cache_key, ranked_ids, RECOMMENDED_CACHE_TIMEOUT)
+
+        favorites = set(Favorite.objects.filter(
+            user=request.user, recipe_id__in=ranked_ids
+        ).values_list('recipe_id', flat=True))
+        return self.paginate_ids(
+            [pk for pk in ranked_ids if pk not in favorites])
+
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny])
+    def match(self, request):
+        """
+        Рецепты, которые можно приготовить из имеющихся продуктов.
+
+        Рецепты ранжируются по доле имеющихся ингредиентов, числу
+        недостающих и нехватке количества (recipes.indexes.RecipeMatrix).
+        """
+        serializer = PantrySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        matches = recipe_matrix.match(
+            serializer.validated_data['ingredients'],
+            limit=serializer.validated_data['limit'],
+            min_coverage=serializer.validated_data['min_coverage'],
+        )
+        recipes = self.queryset.defer('text').in_bulk(
+            [recipe_id for recipe_id, *_ in matches])
+        matches = [item for item in matches if item[0] in recipes]
+        context = {
+            **self.get_serializer_context(),
+            'fields': RECIPE_VIEWS['card'],
+        }
+        cards = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id, *_ in matches],
+            many=True, context=context
+        ).data
+        return Response({'results': [
+            {
+                'recipe': card,
+                'coverage': round(coverage, 4),
+                'missing': missing,
+                'shortfall': round(shortfall, 4),
+            }
+            for card, (_, coverage, missing, shortfall) in zip(cards, matches)
+        ]})
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Рецепты с похожим набором ингредиентов (recipes.similarity).
+
+        Список id кэшируется до изменения корзин рецепта в индексе
+        сходства.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), SIMILAR_MAX_LIMIT) if (
+            limit.isdigit() and int(limit) > 0) else SIMILAR_LIMIT
+
+        cache_key = (
+            f'recipes:similar:{recipe.pk}:{limit}:'
+            f'{similarity.get_version(recipe.pk)}')
+        scored = cache.get(cache_key)
+        if scored is None:
+            scored = similarity.find_similar(recipe.pk, limit)
+            cache.set(cache_key, scored, SIMILAR_CACHE_TIMEOUT)
+
+        recipes = self.queryset.defer('text').in_bulk(
+            [recipe_id for recipe_id, _ in scored])
+        scored = [item for item in scored if item[0] in recipes]
+        context = {
+            **self.get_serializer_context(),
+            'fields': RECIPE_VIEWS['card'],
+        }
+        cards = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _ in scored],
+            many=True, context=context
+        ).data
+        return Response({'results': [
+            {'recipe': card, 'similarity': round(score, 4)}
+            for card, (_, score) in zip(cards, scored)
+        ]})
+
     @action(detail=True, methods=['get'])
     def get_link(self, request, pk=None):
         recipe = self.get_object()
-        short_link = f"https://foodgram.example.org/s/{recipe.id}"
+        link = get_short_link(recipe.id)
+        short_link = request.build_absolute_uri(
+            reverse('short_link', kwargs={'code': link.code}))
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
 
@@ -269,15 +528,58 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
     pagination_class = StandardPagination
 
     def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user)
+        return Subscription.objects.filter(
+            user=self.request.user
+        ).select_related('author').annotate(
+            recipes_count=Count('author__recipes')
+        ).order_by('author')
 
     @action(detail=False, methods=['get'])
     def subscriptions(self, request):
         queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
-        serializer = self.get_serializer(page, many=True)
+        limit = request.query_params.get('recipes_limit')
+        context = self.get_serializer_context()
+        context['recipes_by_author'] = self.get_recipes_by_author(
+            [subscription.author_id for subscription in page],
+            int(limit) if limit and limit.isdigit() else None
+        )
+        serializer = self.get_serializer(page, many=True, context=context)
         return self.get_paginated_response(serializer.data)
 
+    def get_recipes_by_author(self, author_ids, limit=None):
+        """
+        Последние рецепты авторов страницы одним запросом.
+
+        Ограничение на количество рецептов каждого автора делается
+        оконной функцией ROW_NUMBER() OVER (PARTITION BY author_id).
+        """
+        recipes = Recipe.objects.filter(
+            author_id__in=author_ids
+        ).order_by('-pub_date').only(
+            'id', 'author_id', 'name', 'image', 'cooking_time')
+        if limit is not None:
+            ranked = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('pub_date').desc(),
+            )).order_by().values(
+                'id', 'author_id', 'name', 'image', 'cooking_time',
+                'pub_date', 'row_number'
+            )
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                f'WHERE ranked.row_number <= %s '
+                f'ORDER BY ranked.author_id, ranked.row_number',
+                (*params, limit)
+            )
+
+        recipes_by_author = {author_id: [] for author_id in author_ids}
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        return recipes_by_author
+
     @action(detail=True, methods=['post', 'delete'])
     def subscribe(self, request, pk=None):
         author = get_object_or_404(User, pk=pk)
@@ -287,6 +589,41 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         elif request.method == 'DELETE':
             return self._unsubscribe(request.user, author)
 
+    def bulk_subscribe(self, request):
+        """Подписка на нескольких авторов или отписка от них."""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+
+        # Массовые операции не отправляют сигналы Subscription,
+        # поэтому ленты обновляются здесь
+        with transaction.atomic():
+            if request.method == 'POST':
+                candidates = [pk for pk in ids if pk != user.id]
+                changed = Subscription.objects.add_many(user, candidates)
+                rest = [pk for pk in candidates if pk not in changed]
+                found = set(User.objects.filter(
+                    id__in=rest).values_list('id', flat=True)) if rest else ()
+                for author_id in changed:
+                    timeline.schedule_backfill(user.id, author_id)
+                results = [
+                    {'id': pk, 'status': 'self' if pk == user.id
+                     else 'added' if pk in changed
+                     else 'exists' if pk in found else 'not_found'}
+                    for pk in ids
+                ]
+            else:
+                changed = Subscription.objects.remove_many(user, ids)
+                if changed:
+                    timeline.purge_many(user.id, changed)
+                results = [
+                    {'id': pk,
+                     'status': 'removed' if pk in changed else 'not_found'}
+                    for pk in ids
+                ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
     def _subscribe(self, user, author):
         serializer = self.get_serializer(data={}, context={
             'request': self.request,
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после настройки Django: модулю нужны модели
+from api.sse import STREAM_PATH, recipe_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Поток событий обслуживается напрямую, минуя обработку запроса
+    # Django: в Django 3.2 нет асинхронных потоковых ответов.
+    if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+        await recipe_events(scope, receive, send)
+        return
+    await django_application(scope, receive, send)
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -160,13 +161,105 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    # JSON через orjson, без него — стандартные классы DRF
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     # 'DEFAULT_PAGINATION_CLASS': None,
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 10,
 } 
 
+# Общий кэш нужен, чтобы все процессы gunicorn видели одни версии тегов,
+# ответы и сброс токенов (в docker-compose — memcached). Кэш в памяти
+# процесса годится только для разработки с одним процессом.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+SHARED_CACHE = CACHES['default']['BACKEND'].rsplit('.', 1)[-1] not in (
+    'LocMemCache', 'DummyCache')
+
+# Период полураспада рейтинга популярности рецептов
+POPULARITY_HALF_LIFE_HOURS = int(
+    os.getenv('POPULARITY_HALF_LIFE_HOURS', 72))
+
+# Заполнять ленту подписок при подписке в фоновом потоке
+TIMELINE_BACKFILL_ASYNC = True
+
+# Обновлять сигнатуры похожих рецептов (recipes.similarity) в фоновом потоке
+SIMILARITY_UPDATE_ASYNC = True
+
+# Брокер событий о новых рецептах для потока /api/recipes/stream/.
+# Для нескольких процессов нужен api.events.PostgresBroker.
+RECIPE_EVENTS_BROKER = os.getenv(
+    'RECIPE_EVENTS_BROKER', 'api.events.InProcessBroker')
+
+# Кэш токенов аутентификации: размер и время жизни (в секундах)
+# записей в памяти процесса и в общем кэше. Без общего кэша выход
+# пользователя сбрасывает токен только в своём процессе, поэтому записи
+# живут не дольше, чем в кэше процесса.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_LOCAL_TTL = 30
+TOKEN_CACHE_SHARED_TTL = 60 * 60 if SHARED_CACHE else TOKEN_CACHE_LOCAL_TTL
+
+# Количество рецептов в кэше представлений каждого процесса
+RECIPE_FRAGMENT_CACHE_SIZE = 5000
+
+# Кэш ответов для анонимных пользователей: размер кэша процесса и время
+# жизни записей (в секундах) в памяти процесса и в общем кэше
+RESPONSE_CACHE_SIZE = 1000
+RESPONSE_CACHE_LOCAL_TTL = 60
+RESPONSE_CACHE_SHARED_TTL = 5 * 60
+
+# Пакетные запросы /api/batch/: максимум подзапросов в пакете и потоков
+# для параллельного выполнения GET-подзапросов
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+# Сжатие ответов (api.middleware): минимальный размер ответа в байтах,
+# сжимаемые типы содержимого и размер кэша сжатых тел кэшированных ответов.
+# HTML не сжимается: страницы админки содержат CSRF-токен и отражают
+# ввод пользователя, а сжатие таких страниц открывает атаку BREACH.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CONTENT_TYPES = (
+    'application/json',
+    'text/plain',
+)
+COMPRESSED_BODY_CACHE_SIZE = 500
+
+# Индекс ингредиентов в памяти для фильтра ?ingredients= (recipes.indexes):
+# минимальный интервал между перестроениями устаревшего индекса (в секундах)
+# и максимум найденных рецептов, при котором фильтр строится по индексу,
+# а не SQL-запросом. Устаревший индекс перестраивается в фоновом потоке.
+INGREDIENT_INDEX_ENABLED = True
+INGREDIENT_INDEX_REBUILD_INTERVAL = 30
+INGREDIENT_INDEX_REBUILD_ASYNC = True
+INGREDIENT_INDEX_MAX_IDS = 10000
+
+# Короткие ссылки /s/<code> (api.shortlinks): размер и время жизни (в секундах)
+# кэша кодов в памяти процесса, число переходов и интервал (в секундах),
+# после которых фоновый поток записывает накопленные счётчики в базу.
+# Без фонового потока переходы записываются только при завершении процесса.
+SHORT_LINK_CACHE_SIZE = 10000
+SHORT_LINK_CACHE_TTL = 60 * 60
+SHORT_LINK_FLUSH_SIZE = 100
+SHORT_LINK_FLUSH_INTERVAL = 10
+SHORT_LINK_FLUSH_ASYNC = True
+
 DJOSER = {
     'LOGIN_FIELD': 'email',  
 }
@@ -2,6 +2,11 @@ import pytest
 import random
 import shutil
 from django.conf import settings
+from django.core.cache import cache
+from api.fragments import recipe_fragments
+from api.response_cache import response_cache
+from api.middleware import compressed_bodies
+from api.shortlinks import click_buffer, resolved_links
 from recipes.models import Ingredient, Recipe, ShoppingCart, Subscription
 from users.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -17,6 +22,19 @@ def cleanup_media(tmp_path):
     shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Кэш не должен переживать отдельный тест
+    cache.clear()
+    recipe_fragments.clear()
+    response_cache.clear()
+    compressed_bodies.clear()
+    resolved_links.clear()
+    click_buffer.clear()
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def sample_user():
     return User.objects.create_user(
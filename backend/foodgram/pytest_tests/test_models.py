@@ -1,10 +1,15 @@
 import pytest
+from datetime import timedelta
+from django.db import connection
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 from users.models import User
 from recipes.models import (Ingredient, 
                             Recipe, Favorite, RecipeIngredient,
                             Subscription, ShoppingCart)
+from recipes.popularity import update_popularity
+from api.filters import RecipeFilter
 
 
 @pytest.mark.django_db
@@ -249,3 +254,90 @@ class TestSubscription:
         
         assert sample_author.following.count() == 1
         assert sample_user.follower.count() == 1
+
+
+@pytest.mark.django_db
+class TestPopularity:
+    """Тесты для пересчёта рейтинга популярности."""
+
+    def test_recent_events_rank_higher(self, sample_user, sample_author,
+                                       sample_recipe, sample_recipe_alt):
+        """Свежие добавления весят больше старых."""
+        old = Favorite.objects.create(user=sample_user, recipe=sample_recipe)
+        Favorite.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(days=30))
+        Favorite.objects.create(user=sample_author, recipe=sample_recipe)
+        Favorite.objects.create(user=sample_user, recipe=sample_recipe_alt)
+
+        assert update_popularity() == 2
+        sample_recipe.refresh_from_db()
+        sample_recipe_alt.refresh_from_db()
+        assert sample_recipe_alt.popularity > 0
+        assert sample_recipe.popularity > sample_recipe_alt.popularity
+
+    def test_incremental_update_matches_full(self, sample_user,
+                                             sample_author, sample_recipe):
+        """Инкрементальный пересчёт совпадает с полным."""
+        Favorite.objects.create(user=sample_user, recipe=sample_recipe)
+        update_popularity()
+        ShoppingCart.objects.create(user=sample_author, recipe=sample_recipe)
+        update_popularity()
+        sample_recipe.refresh_from_db()
+        incremental = sample_recipe.popularity
+
+        update_popularity(full=True)
+        sample_recipe.refresh_from_db()
+        assert sample_recipe.popularity == pytest.approx(incremental)
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != "postgresql",
+                    reason="Планы запросов проверяются на PostgreSQL")
+class TestQueryPlans:
+    """Фильтры и сортировки списка рецептов используют индексы."""
+
+    @pytest.fixture
+    def seeded(self, sample_user, sample_author):
+        image = SimpleUploadedFile("r.jpg", b"x", content_type="image/jpeg")
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=(sample_user, sample_author)[i % 2],
+                   name=f"Рецепт {i}", text="Текст", image=image.name,
+                   cooking_time=i % 120 + 1, pub_date=timezone.now())
+            for i in range(2000)
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=sample_user, recipe=recipe)
+            for recipe in recipes[::3]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            # На маленькой таблице полный просмотр дешевле любого индекса
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return sample_user
+
+    def test_author_recipes_by_date(self, seeded):
+        plan = Recipe.objects.filter(
+            author=seeded).order_by("-pub_date")[:6].explain()
+        assert "recipe_author_date_idx" in plan
+
+    def test_cooking_time_range(self, seeded):
+        # Запрос первой страницы списка: фильтр и сортировка по умолчанию
+        queryset = RecipeFilter(
+            {"cooking_time_min": "10", "cooking_time_max": "20"},
+            queryset=Recipe.objects.all(),
+        ).qs
+        assert str(queryset.query).endswith(
+            'ORDER BY "recipes_recipe"."pub_date" DESC')
+        plan = queryset[:6].explain()
+        assert "recipe_time_date_idx" in plan
+
+    def test_favorited_filter_index_only(self, seeded):
+        plan = Favorite.objects.filter(
+            user=seeded, recipe_id__in=[1, 2, 3]
+        ).values_list("recipe_id").explain()
+        assert "Index Only Scan using unique_favorite" in plan
+
+    def test_recent_favorites_index_only(self, seeded):
+        plan = Favorite.objects.filter(user=seeded).order_by(
+            "-created_at").values_list("recipe_id", flat=True)[:200].explain()
+        assert "Index Only Scan using favorite_user_recent_idx" in plan
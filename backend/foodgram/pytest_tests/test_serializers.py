@@ -9,7 +9,9 @@ from api.serializers import (UserSerializer,
                              AuthorSerializer,
                              RecipeSerializer, 
                              SubscriptionSerializer)
-from recipes.models import Subscription, Favorite, ShoppingCart, Recipe
+from recipes.models import (Subscription, Favorite, ShoppingCart, Recipe,
+                            RecipeIngredient)
+from api.fragments import recipe_fragments
 from users.models import User
 from rest_framework.test import APIRequestFactory, force_authenticate
 import os
@@ -463,6 +465,32 @@ class TestRecipeSerializer:
         assert recipe.ingredients.count() == 1
         assert recipe.recipe_ingredients.first().amount == 100
 
+    @pytest.mark.django_db
+    def test_ingredients_resolved_in_one_query(self, sample_user_api,
+                                               sample_ingredients,
+                                               base64_image,
+                                               django_assert_num_queries):
+        """Тест загрузки ингредиентов одним запросом при валидации."""
+        data = {
+            "name": "Новый рецепт",
+            "text": "Описание рецепта",
+            "cooking_time": 30,
+            "image": base64_image,
+            "ingredients": [
+                {"id": ingredient.id, "amount": 10}
+                for ingredient in sample_ingredients
+            ] + [{"id": 999999, "amount": 10}],
+        }
+        serializer = RecipeSerializer(data=data)
+
+        with django_assert_num_queries(1):
+            assert not serializer.is_valid()
+
+        errors = serializer.errors["ingredients"]
+        assert errors[:len(sample_ingredients)] == [
+            {} for _ in sample_ingredients]
+        assert errors[-1]["id"][0].code == "does_not_exist"
+
     @pytest.mark.django_db
     def test_validate_ingredients(self, sample_ingredient):
         """Тест валидации ингредиентов."""
@@ -579,6 +607,70 @@ class TestRecipeSerializer:
         assert recipe.ingredients.first() == another_ingredient
         assert recipe.recipe_ingredients.first().amount == 200
 
+    @pytest.mark.django_db
+    def test_update_ingredients_diff(self, sample_recipe, sample_ingredients,
+                                     django_assert_num_queries):
+        """Тест обновления только изменившихся ингредиентов."""
+        flour, sugar, egg = sample_ingredients
+        RecipeIngredient.objects.create(
+            recipe=sample_recipe, ingredient=flour, amount=100)
+        kept = RecipeIngredient.objects.create(
+            recipe=sample_recipe, ingredient=sugar, amount=50)
+
+        factory = APIRequestFactory()
+        request = factory.patch('/')
+        request.user = sample_recipe.author
+        serializer = RecipeSerializer(
+            instance=sample_recipe,
+            data={"ingredients": [
+                {"id": sugar.id, "amount": 70},
+                {"id": egg.id, "amount": 2},
+            ]},
+            context={'request': request},
+            partial=True
+        )
+        assert serializer.is_valid(), serializer.errors
+
+        # Точка сохранения, проверка автора, рецепт, выборка ингредиентов,
+        # выборка и удаление строк, отметка об изменении рецепта,
+        # обновление, добавление
+        with django_assert_num_queries(10):
+            serializer.save()
+
+        amounts = dict(sample_recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'amount'))
+        assert amounts == {sugar.id: 70, egg.id: 2}
+        assert sample_recipe.recipe_ingredients.get(
+            ingredient=sugar).pk == kept.pk
+
+    @pytest.mark.django_db
+    def test_representation_cache(self, sample_recipe, sample_user_api_2):
+        """Тест кэша представлений и наложения флагов пользователя."""
+        factory = APIRequestFactory()
+        request = factory.get('/')
+        request.user = sample_user_api_2
+
+        data = RecipeSerializer(
+            sample_recipe, context={'request': request}).data
+        assert data['is_favorited'] is False
+        assert recipe_fragments.stats['misses'] == 1
+
+        # Флаги пользователя не хранятся в кэше
+        Favorite.objects.create(user=sample_user_api_2, recipe=sample_recipe)
+        data = RecipeSerializer(
+            sample_recipe, context={'request': request}).data
+        assert data['is_favorited'] is True
+        assert recipe_fragments.stats['hits'] == 1
+
+        # Изменение автора сбрасывает кэш его рецептов
+        author = sample_recipe.author
+        author.first_name = 'Новое имя'
+        author.save()
+        data = RecipeSerializer(
+            sample_recipe, context={'request': request}).data
+        assert data['author']['first_name'] == 'Новое имя'
+        assert recipe_fragments.stats['misses'] == 2
+
 
 class TestSubscriptionSerializer:
     """Тесты для SubscriptionSerializer."""
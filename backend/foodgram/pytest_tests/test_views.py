@@ -1,8 +1,33 @@
+import asyncio
+import gzip
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
 import pytest
+from asgiref.sync import async_to_sync
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from recipes.models import Favorite, ShoppingCart, Subscription
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeSignature, ShoppingCart, ShortLink,
+                            Subscription)
+from recipes import indexes, similarity, timeline
+from recipes.popularity import update_popularity
+from api.events import hub
+from api.middleware import compressed_bodies
+from api.pagination import CachedCountPaginator
+from api.shortlinks import click_buffer
+from api.renderers import FastJSONRenderer
+from foodgram.asgi import application
 
 User = get_user_model()
 
@@ -63,7 +88,46 @@ class TestUserViewSet:
         assert 'next' in response.data
         assert 'previous' in response.data
         assert 'results' in response.data
-        assert len(response.data['results']) == 6  
+        assert len(response.data['results']) == 6
+
+
+@pytest.mark.django_db
+class TestCachedTokenAuthentication:
+    """Тесты для кэширующей аутентификации по токену."""
+
+    def _client(self, user):
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def test_cached_user_costs_no_queries(self, sample_user_api,
+                                          django_assert_num_queries):
+        """Повторная аутентификация не обращается к базе."""
+        client = self._client(sample_user_api)
+        assert client.get('/api/users/me/').status_code == status.HTTP_200_OK
+        # Единственный запрос — проверка is_subscribed в сериализаторе
+        with django_assert_num_queries(1):
+            response = client.get('/api/users/me/')
+        assert response.data['username'] == 'testuser'
+
+    def test_logout_invalidates_token(self, sample_user_api):
+        """После выхода токен перестаёт действовать."""
+        client = self._client(sample_user_api)
+        client.get('/api/users/me/')
+        response = client.post('/api/auth/token/logout/')
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.get('/api/users/me/')
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_deactivation_invalidates_token(self, sample_user_api):
+        """Заблокированный пользователь теряет доступ сразу."""
+        client = self._client(sample_user_api)
+        client.get('/api/users/me/')
+        sample_user_api.is_active = False
+        sample_user_api.save()
+        response = client.get('/api/users/me/')
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
 @pytest.mark.django_db
@@ -118,6 +182,101 @@ class TestRecipeViewSet:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['results']) >= 2
 
+    def test_list_recipes_cached(self, sample_user_api, sample_recipe,
+                                 sample_recipe_alt,
+                                 django_assert_num_queries):
+        """Тест списка рецептов из кэша представлений."""
+        Favorite.objects.create(user=sample_user_api, recipe=sample_recipe)
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        client.get('/api/recipes/')
+
+        # Валидаторы ETag (время изменения и состояние пользователя),
+        # подсчёт, страница и флаги пользователя
+        with django_assert_num_queries(5):
+            response = client.get('/api/recipes/')
+        flags = {r['id']: r['is_favorited'] for r in response.data['results']}
+        assert flags == {sample_recipe.id: True, sample_recipe_alt.id: False}
+
+    def test_anonymous_response_cache(self, sample_recipe,
+                                      django_assert_num_queries):
+        """Тест кэша ответов для анонимных пользователей."""
+        client = APIClient()
+        url = f'/api/recipes/{sample_recipe.id}/'
+        assert client.get(url)['X-Cache'] == 'MISS'
+        with django_assert_num_queries(0):
+            response = client.get(url)
+        assert response['X-Cache'] == 'HIT'
+
+        # Ссылки на картинки абсолютные, у другого адреса — свой ответ
+        response = client.get(url, HTTP_HOST='localhost')
+        assert response['X-Cache'] == 'MISS'
+        assert response.json()['image'].startswith('http://localhost/')
+
+        sample_recipe.name = 'Щи'
+        sample_recipe.save()
+        response = client.get(url)
+        assert response['X-Cache'] == 'MISS'
+        assert response.json()['name'] == 'Щи'
+
+    def test_anonymous_list_cache_invalidation(self, sample_recipe,
+                                               sample_recipe_alt):
+        """Тест сброса кэша списка при удалении рецепта."""
+        client = APIClient()
+        assert client.get('/api/recipes/').data['count'] == 2
+        response = client.get('/api/recipes/')
+        assert response['X-Cache'] == 'HIT'
+        # Удаление не меняет время изменения, список отдаётся без него
+        assert not response.has_header('Last-Modified')
+        sample_recipe_alt.delete()
+        response = client.get('/api/recipes/',
+                              HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+
+    def test_conditional_get_detail(self, sample_recipe):
+        """Тест ответа 304 для неизменившегося рецепта."""
+        client = APIClient()
+        url = f'/api/recipes/{sample_recipe.id}/'
+        response = client.get(url)
+        etag = response['ETag']
+        assert response.has_header('Last-Modified')
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # Изменение ингредиентов меняет рецепт
+        ingredient = Ingredient.objects.create(name='Соль',
+                                               measurement_unit='г')
+        RecipeIngredient.objects.create(recipe=sample_recipe,
+                                        ingredient=ingredient, amount=5)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+        # Строки ингредиента удаляются вместе с ним каскадом
+        etag = response['ETag']
+        ingredient.delete()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['ingredients'] == []
+
+    def test_conditional_get_list_authenticated(self, sample_user_api,
+                                                sample_recipe,
+                                                django_assert_num_queries):
+        """Тест ETag списка, зависящего от избранного пользователя."""
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        etag = client.get('/api/recipes/')['ETag']
+        with django_assert_num_queries(2):
+            response = client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        Favorite.objects.create(user=sample_user_api, recipe=sample_recipe)
+        response = client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['is_favorited'] is True
+
     def test_search_by_name(self, sample_recipe, sample_recipe_alt):
         """Тест поиска рецепта по имени."""
         client = APIClient()
@@ -132,9 +291,420 @@ class TestRecipeViewSet:
         response = client.get(
             f'/api/recipes/?author={sample_another_user_api.id}')
         assert response.status_code == status.HTTP_200_OK
-        assert all(r["author"]["username"] == "ggg" 
+        assert all(r["author"]["username"] == "ggg"
                    for r in response.data["results"])
 
+    def test_filter_cooking_time_and_authors(self, sample_user_api,
+                                             sample_recipe, sample_recipe_alt,
+                                             sample_image):
+        """Тест фильтров по времени приготовления и нескольким авторам."""
+        quick = Recipe.objects.create(
+            author=sample_user_api, name='Салат', text='Текст',
+            cooking_time=10, image=sample_image)
+        client = APIClient()
+
+        def found(query):
+            response = client.get(f'/api/recipes/?{query}')
+            assert response.status_code == status.HTTP_200_OK
+            return {recipe['id'] for recipe in response.data['results']}
+
+        assert found('cooking_time_max=15') == {quick.id}
+        assert found('cooking_time_min=15&cooking_time_max=30') == {
+            sample_recipe.id, sample_recipe_alt.id}
+        assert found(
+            f'author={sample_user_api.id},{sample_recipe_alt.author_id}'
+            '&cooking_time_min=20'
+        ) == {sample_recipe.id, sample_recipe_alt.id}
+        assert found('is_favorited=1') == set()
+        assert client.get('/api/recipes/?author=x').status_code == (
+            status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_and_estimated_count(self, monkeypatch, sample_user_api,
+                                        sample_recipe, sample_recipe_alt,
+                                        sample_image):
+        """Тест кэшируемого и приблизительного числа рецептов."""
+        monkeypatch.setattr(CachedCountPaginator, 'exact_count_limit', 2)
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        url = f'/api/recipes/?author={sample_user_api.id},' \
+              f'{sample_recipe_alt.author_id}'
+        response = client.get(url)
+        assert response.data['count'] == 2
+        assert response.data['count_is_estimate'] is False
+
+        # Большой список считается заново только после истечения кэша
+        Recipe.objects.create(author=sample_user_api, name='Третий',
+                              text='Текст', cooking_time=5,
+                              image=sample_image)
+        response = client.get(url)
+        assert response.data['count'] == 2
+        assert response.data['count_is_estimate'] is True
+        assert len(response.data['results']) == 3
+
+        monkeypatch.setattr('api.pagination.get_table_estimate',
+                            lambda queryset: 5000)
+        response = client.get('/api/recipes/')
+        assert response.data['count'] == 5000
+        assert response.data['count_is_estimate'] is True
+        assert client.get('/api/recipes/?page=x').status_code == (
+            status.HTTP_404_NOT_FOUND)
+
+    def test_recipe_fields(self, sample_user_api, sample_recipe,
+                           django_assert_num_queries):
+        """Тест выбора полей рецепта параметрами view, fields и omit."""
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+
+        # ETag, состояние пользователя, страница, рецепты, автор, флаги
+        with django_assert_num_queries(6):
+            response = client.get('/api/recipes/?view=card')
+        recipe = response.data['results'][0]
+        assert set(recipe) == {
+            'id', 'author', 'image', 'name', 'cooking_time',
+            'is_favorited', 'is_in_shopping_cart'}
+
+        response = client.get(
+            f'/api/recipes/{sample_recipe.id}/?fields=name,text')
+        assert set(response.data) == {'id', 'name', 'text'}
+
+        response = client.get(
+            f'/api/recipes/{sample_recipe.id}/?omit=ingredients,author')
+        assert 'ingredients' not in response.data
+        assert 'author' not in response.data
+        assert response.data['text'] == sample_recipe.text
+
+    def test_sideload_authors(self, sample_user_api, sample_recipe,
+                              sample_recipe_alt, sample_image):
+        """Тест компактного формата с авторами страницы отдельно."""
+        Recipe.objects.create(author=sample_user_api, name='Второй',
+                              text='Текст', cooking_time=5,
+                              image=sample_image)
+        client = APIClient()
+        response = client.get('/api/recipes/?sideload=authors')
+
+        results = response.data['results']
+        assert len(results) == 3
+        assert all('author' not in recipe for recipe in results)
+        assert set(response.data['authors']) == {
+            sample_user_api.id, sample_recipe_alt.author_id}
+        author = response.data['authors'][sample_user_api.id]
+        assert author['username'] == sample_user_api.username
+        assert author['is_subscribed'] is False
+
+    @pytest.mark.parametrize('use_index', [True, False])
+    def test_filter_by_ingredients(self, settings, use_index, sample_recipe,
+                                   sample_recipe_alt, sample_ingredients):
+        """Тест фильтра по ингредиентам через индекс и через SQL."""
+        settings.INGREDIENT_INDEX_ENABLED = use_index
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = False
+        flour, sugar, egg = sample_ingredients
+        for recipe, ingredients in ((sample_recipe, (flour, sugar)),
+                                    (sample_recipe_alt, (flour, egg))):
+            for ingredient in ingredients:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+        client = APIClient()
+
+        def found(query):
+            response = client.get(f'/api/recipes/?{query}')
+            return {recipe['id'] for recipe in response.data['results']}
+
+        both = {sample_recipe.id, sample_recipe_alt.id}
+        assert found(f'ingredients={flour.id}') == both
+        assert found(f'ingredients={flour.id},{sugar.id}') == {
+            sample_recipe.id}
+        assert found(f'ingredients={sugar.id},{egg.id}') == set()
+        assert found(
+            f'ingredients={sugar.id},{egg.id}&ingredients_mode=any') == both
+        assert found(f'ingredients={flour.id}&exclude_ingredients={egg.id}'
+                     ) == {sample_recipe.id}
+        assert found(f'exclude_ingredients={sugar.id}') == {
+            sample_recipe_alt.id}
+        assert client.get('/api/recipes/?ingredients=x').status_code == (
+            status.HTTP_400_BAD_REQUEST)
+
+    def test_ingredient_index_rebuilds_in_background(
+            self, settings, monkeypatch, sample_recipe, sample_ingredients):
+        """Пока индекс перестраивается в фоне, фильтр работает через SQL."""
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = True
+        tasks = []
+        monkeypatch.setattr(indexes._executor, 'submit',
+                            lambda function, *args: tasks.append(
+                                (function, args)))
+        # Фоновый поток здесь выполняется на соединении теста
+        monkeypatch.setattr(indexes.connection, 'close', lambda: None)
+        monkeypatch.setattr(indexes.ingredient_index, '_snapshot', None)
+        flour, sugar, _ = sample_ingredients
+        RecipeIngredient.objects.create(
+            recipe=sample_recipe, ingredient=flour, amount=1)
+        # Анонимные ответы кэшируются целиком
+        client = APIClient()
+        client.force_authenticate(sample_recipe.author)
+
+        def found(query):
+            response = client.get(f'/api/recipes/?{query}')
+            return {recipe['id'] for recipe in response.data['results']}
+
+        assert found(f'ingredients={flour.id}') == {sample_recipe.id}
+        assert not tasks
+        RecipeIngredient.objects.create(
+            recipe=sample_recipe, ingredient=sugar, amount=1)
+        assert found(f'ingredients={sugar.id}') == {sample_recipe.id}
+        assert found(f'ingredients={sugar.id}') == {sample_recipe.id}
+        # Устаревший снимок не используется
+        assert indexes.ingredient_index.match([sugar.id]) is None
+        assert len(tasks) == 1
+
+        function, args = tasks.pop()
+        function(*args)
+        assert indexes.ingredient_index.match([sugar.id]).tolist() == [
+            sample_recipe.id]
+        assert found(f'ingredients={sugar.id}') == {sample_recipe.id}
+        assert not tasks
+
+    def test_ingredient_index_after_row_delete(
+            self, settings, sample_recipe, sample_ingredients,
+            django_capture_on_commit_callbacks):
+        """Удаление строк в обход API (админка, запрос) меняет индексы."""
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = False
+        settings.SIMILARITY_UPDATE_ASYNC = False
+        flour, sugar, egg = sample_ingredients
+        rows = {
+            ingredient: RecipeIngredient.objects.create(
+                recipe=sample_recipe, ingredient=ingredient, amount=100)
+            for ingredient in (flour, sugar, egg)
+        }
+        client = APIClient()
+        client.force_authenticate(sample_recipe.author)
+
+        def found(query):
+            response = client.get(f'/api/recipes/?{query}')
+            return {recipe['id'] for recipe in response.data['results']}
+
+        def coverage():
+            response = client.post('/api/recipes/match/', {'ingredients': [
+                {'id': flour.id}]}, format='json')
+            return response.data['results'][0]['coverage']
+
+        assert found(f'exclude_ingredients={egg.id}') == set()
+        assert coverage() == round(1 / 3, 4)
+
+        # Встроенная форма админки удаляет строку через obj.delete()
+        with django_capture_on_commit_callbacks(execute=True):
+            rows[egg].delete()
+        assert found(f'exclude_ingredients={egg.id}') == {sample_recipe.id}
+        assert coverage() == 0.5
+        signature = RecipeSignature.objects.get(recipe=sample_recipe)
+        assert bytes(signature.minhash) == similarity.minhash(
+            [flour.id, sugar.id]).tobytes()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            RecipeIngredient.objects.filter(
+                recipe=sample_recipe, ingredient=sugar).delete()
+        assert found(f'ingredients={sugar.id}') == set()
+        assert coverage() == 1
+
+    def test_facets(self, sample_user_api, sample_recipe, sample_recipe_alt,
+                    sample_ingredients):
+        """Тест фасетов списка рецептов и их кэширования."""
+        flour, sugar, egg = sample_ingredients
+        for recipe, ingredients in ((sample_recipe, (flour, sugar)),
+                                    (sample_recipe_alt, (flour, egg))):
+            for ingredient in ingredients:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+
+        def get_facets(query):
+            response = client.get(f'/api/recipes/?{query}')
+            assert response.status_code == status.HTTP_200_OK
+            return response.data['facets']
+
+        facets = get_facets(
+            f'facets=cooking_time,ingredients,author&ingredients={flour.id}')
+        assert {item['value']: item['count']
+                for item in facets['cooking_time']} == {
+            '0-15': 0, '15-30': 0, '30-60': 2, '60+': 0}
+        assert facets['ingredients'][0] == {
+            'id': flour.id, 'name': flour.name,
+            'measurement_unit': flour.measurement_unit, 'count': 2}
+        assert len(facets['ingredients']) == 3
+        assert {item['username']: item['count']
+                for item in facets['author']} == {'testuser': 1, 'ggg': 1}
+
+        # Без сигналов кэш не сбрасывается, порядок параметров не важен
+        Recipe.objects.filter(pk=sample_recipe.pk).update(cooking_time=5)
+        facets = get_facets(f'ingredients={flour.id}&facets=cooking_time')
+        assert facets['cooking_time'][0]['count'] == 0
+        sample_recipe.refresh_from_db()
+        sample_recipe.save()
+        facets = get_facets(f'ingredients={flour.id}&facets=cooking_time')
+        assert facets['cooking_time'][0]['count'] == 1
+
+        assert client.get('/api/recipes/?facets=unknown').status_code == (
+            status.HTTP_400_BAD_REQUEST)
+
+    def test_facets_follow_ingredient_index(self, settings, sample_recipe,
+                                            sample_recipe_alt,
+                                            sample_ingredients):
+        """Фасеты фильтра по ингредиентам зависят от версии индекса."""
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = False
+        flour, sugar, _ = sample_ingredients
+        RecipeIngredient.objects.create(
+            recipe=sample_recipe, ingredient=sugar, amount=1)
+        client = APIClient()
+        client.force_authenticate(user=sample_recipe.author)
+        url = f'/api/recipes/?facets=author&ingredients={sugar.id}'
+        assert len(client.get(url).data['facets']['author']) == 1
+
+        # Теги кэша не меняются, меняется только версия индекса
+        RecipeIngredient.objects.bulk_create([RecipeIngredient(
+            recipe=sample_recipe_alt, ingredient=sugar, amount=1)])
+        indexes.bump_index_version()
+        assert len(client.get(url).data['facets']['author']) == 2
+
+    def test_match_pantry(self, settings, sample_recipe, sample_recipe_alt,
+                          sample_ingredients):
+        """Тест подбора рецептов по имеющимся продуктам."""
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = False
+        flour, sugar, egg = sample_ingredients
+        for recipe, ingredients in ((sample_recipe, (flour, sugar)),
+                                    (sample_recipe_alt, (flour, egg))):
+            for ingredient in ingredients:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=100)
+
+        response = APIClient().post('/api/recipes/match/', {'ingredients': [
+            {'id': flour.id},
+            {'id': sugar.id, 'amount': 50},
+            {'id': egg.id, 'amount': 200},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.data['results']
+        assert [item['recipe']['id'] for item in results] == [
+            sample_recipe_alt.id, sample_recipe.id]
+        assert results[0]['coverage'] == 1
+        assert results[0]['shortfall'] == 0
+        assert results[1]['coverage'] == 1
+        assert results[1]['shortfall'] == 0.25
+        assert 'text' not in results[0]['recipe']
+
+    def test_match_after_amount_update(self, settings, sample_recipe,
+                                       sample_ingredients,
+                                       django_capture_on_commit_callbacks):
+        """Подбор учитывает изменение одного только количества."""
+        settings.INGREDIENT_INDEX_REBUILD_INTERVAL = 0
+        settings.INGREDIENT_INDEX_REBUILD_ASYNC = False
+        flour, sugar, _ = sample_ingredients
+        for ingredient in (flour, sugar):
+            RecipeIngredient.objects.create(
+                recipe=sample_recipe, ingredient=ingredient, amount=100)
+        client = APIClient()
+        pantry = {'ingredients': [
+            {'id': flour.id}, {'id': sugar.id, 'amount': 50}]}
+
+        def shortfall():
+            response = client.post('/api/recipes/match/', pantry,
+                                   format='json')
+            return response.data['results'][0]['shortfall']
+
+        assert shortfall() == 0.25
+        client.force_authenticate(user=sample_recipe.author)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.patch(
+                f'/api/recipes/{sample_recipe.id}/', {'ingredients': [
+                    {'id': flour.id, 'amount': 100},
+                    {'id': sugar.id, 'amount': 200},
+                ]}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert shortfall() == 0.375
+
+    def test_similar_recipes(self, settings, sample_user_api, sample_recipe,
+                             sample_recipe_alt, sample_image,
+                             django_capture_on_commit_callbacks):
+        """Тест похожих рецептов по наборам ингредиентов."""
+        settings.SIMILARITY_UPDATE_ASYNC = False
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {i}',
+                                      measurement_unit='г')
+            for i in range(12)
+        ]
+        other, lonely = (
+            Recipe.objects.create(
+                author=sample_user_api, name=name, text='Текст',
+                cooking_time=5, image=sample_image)
+            for name in ('Другой', 'Одинокий')
+        )
+        for recipe, items in ((sample_recipe, ingredients[:4]),
+                              (sample_recipe_alt, ingredients[:3]),
+                              (other, ingredients[4:8]),
+                              (lonely, ingredients[8:])):
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=item, amount=1)
+                for item in items)
+        call_command('build_similarity', stdout=StringIO())
+
+        client = APIClient()
+        url = f'/api/recipes/{sample_recipe.id}/similar/'
+        results = client.get(url).data['results']
+        assert [item['recipe']['id'] for item in results] == [
+            sample_recipe_alt.id]
+        assert 0.5 <= results[0]['similarity'] <= 1
+
+        # Сигнатура обновляется после изменения ингредиентов рецепта
+        lonely_version = similarity.get_version(lonely.id)
+        client.force_authenticate(user=sample_user_api)
+        with django_capture_on_commit_callbacks(execute=True):
+            client.patch(f'/api/recipes/{other.id}/', {'ingredients': [
+                {'id': item.id, 'amount': 1} for item in ingredients[:4]
+            ]}, format='json')
+        results = client.get(url).data['results']
+        assert results[0]['recipe']['id'] == other.id
+        assert results[0]['similarity'] == 1
+        # Кэш рецептов из незатронутых корзин не сбрасывается
+        assert similarity.get_version(lonely.id) == lonely_version
+
+    def test_recommended(self, user_factory, sample_user_api, sample_image):
+        """Тест рекомендаций по совместному избранному."""
+        author, first, second, third = user_factory.create_batch(4)
+        recipes = [
+            Recipe.objects.create(author=author, name=f'Рецепт {i}',
+                                  text='Текст', cooking_time=5,
+                                  image=sample_image)
+            for i in range(4)
+        ]
+        for user, items in ((first, recipes[:2]),
+                            (second, recipes[:3]),
+                            (third, recipes[2:]),
+                            (sample_user_api, recipes[:1])):
+            for recipe in items:
+                Favorite.objects.create(user=user, recipe=recipe)
+        call_command('build_neighbours', stdout=StringIO())
+
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        response = client.get('/api/recipes/recommended/')
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in response.data['results']] == [
+            recipes[1].id, recipes[2].id]
+
+        # Рецепт из кэшированного списка уже в избранном
+        Favorite.objects.create(user=sample_user_api, recipe=recipes[1])
+        response = client.get('/api/recipes/recommended/')
+        assert [item['id'] for item in response.data['results']] == [
+            recipes[2].id]
+
+        client.force_authenticate(user=None)
+        response = client.get('/api/recipes/recommended/')
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
     def test_add_to_favorite(self, sample_user_api, sample_recipe_alt):
         """Тест добавления рецепта в избранное."""
         client = APIClient()
@@ -143,9 +713,28 @@ class TestRecipeViewSet:
         response = client.post(
             f'/api/recipes/{sample_recipe_alt.id}/favorite/')
         assert response.status_code == status.HTTP_201_CREATED
-        assert Favorite.objects.filter(user=sample_user_api, 
+        assert Favorite.objects.filter(user=sample_user_api,
                                        recipe=sample_recipe_alt).exists()
 
+    def test_toggle_favorite_queries(self, sample_user_api,
+                                     sample_recipe_alt,
+                                     django_assert_num_queries):
+        """Тест добавления и удаления из избранного за два запроса."""
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        url = f'/api/recipes/{sample_recipe_alt.id}/favorite/'
+
+        with django_assert_num_queries(2):
+            assert client.post(url).status_code == status.HTTP_201_CREATED
+        with django_assert_num_queries(2):
+            response = client.post(url)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Favorite.objects.get(user=sample_user_api).created_at
+
+        with django_assert_num_queries(2):
+            assert client.delete(url).status_code == (
+                status.HTTP_204_NO_CONTENT)
+
     def test_remove_from_favorite(self, sample_user_api, sample_recipe_alt):
         """Тест удаления рецепта из избранного."""
         Favorite.objects.create(user=sample_user_api, recipe=sample_recipe_alt)
@@ -155,7 +744,7 @@ class TestRecipeViewSet:
         response = client.delete(
             f'/api/recipes/{sample_recipe_alt.id}/favorite/')
         assert response.status_code == status.HTTP_204_NO_CONTENT
-        assert not Favorite.objects.filter(user=sample_user_api, 
+        assert not Favorite.objects.filter(user=sample_user_api,
                                            recipe=sample_recipe_alt).exists()
 
     def test_add_to_shopping_cart(self, sample_user_api, sample_recipe_alt):
@@ -166,13 +755,34 @@ class TestRecipeViewSet:
         response = client.post(
             f'/api/recipes/{sample_recipe_alt.id}/shopping_cart/')
         assert response.status_code == status.HTTP_201_CREATED
-        assert ShoppingCart.objects.filter(user=sample_user_api, 
+        assert ShoppingCart.objects.filter(user=sample_user_api,
                                            recipe=sample_recipe_alt).exists()
 
-    def test_remove_from_shopping_cart(self, sample_user_api, 
+    def test_bulk_shopping_cart(self, sample_user_api, sample_recipe,
+                                sample_recipe_alt):
+        """Тест массового изменения списка покупок."""
+        ShoppingCart.objects.create(user=sample_user_api,
+                                    recipe=sample_recipe)
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        ids = [sample_recipe.id, sample_recipe_alt.id, 999999]
+
+        response = client.post('/api/recipes/shopping_cart/',
+                               {'ids': ids}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['status'] for item in response.data['results']] == [
+            'exists', 'added', 'not_found']
+
+        response = client.delete('/api/recipes/shopping_cart/',
+                                 {'ids': ids}, format='json')
+        assert [item['status'] for item in response.data['results']] == [
+            'removed', 'removed', 'not_found']
+        assert not sample_user_api.shopping_cart.exists()
+
+    def test_remove_from_shopping_cart(self, sample_user_api,
                                        sample_recipe_alt):
         """Тест удаления рецепта из списка покупок."""
-        ShoppingCart.objects.create(user=sample_user_api, 
+        ShoppingCart.objects.create(user=sample_user_api,
                                     recipe=sample_recipe_alt)
 
         client = APIClient()
@@ -182,7 +792,7 @@ class TestRecipeViewSet:
             f'/api/recipes/{sample_recipe_alt.id}/shopping_cart/')
         assert response.status_code == status.HTTP_204_NO_CONTENT
         assert not ShoppingCart.objects.filter(
-            user=sample_user_api, 
+            user=sample_user_api,
             recipe=sample_recipe_alt).exists()
 
     def test_download_shopping_cart(self, sample_user_api):
@@ -194,12 +804,115 @@ class TestRecipeViewSet:
         assert response.status_code == status.HTTP_200_OK
         assert response['Content-Type'] == 'application/pdf'
 
-    def test_get_short_link(self, sample_recipe):
-        """Тест получения короткой ссылки."""
+    def test_feed(self, settings, sample_user_api, sample_another_user_api,
+                  sample_recipe_alt, sample_image):
+        """Тест ленты рецептов по подпискам."""
+        settings.TIMELINE_BACKFILL_ASYNC = False
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+
+        # Рецепт, опубликованный до подписки, попадает в ленту при подписке
+        client.post(f'/api/users/{sample_another_user_api.id}/subscribe/')
+        new_recipe = Recipe.objects.create(
+            author=sample_another_user_api,
+            name='Новый рецепт',
+            image=sample_image,
+            text='Описание',
+            cooking_time=5
+        )
+        response = client.get('/api/recipes/feed/')
+        assert response.status_code == status.HTTP_200_OK
+        assert [r['id'] for r in response.data['results']] == [
+            new_recipe.id, sample_recipe_alt.id]
+
+        client.delete(f'/api/users/{sample_another_user_api.id}/subscribe/')
+        response = client.get('/api/recipes/feed/')
+        assert response.data['results'] == []
+
+    def test_backfill_after_unsubscribe(self, sample_user_api,
+                                        sample_another_user_api,
+                                        sample_recipe_alt):
+        """Запоздавшее заполнение ленты не возвращает рецепты отписки."""
+        subscription = Subscription.objects.create(
+            user=sample_user_api, author=sample_another_user_api)
+        subscription.delete()
+        timeline.backfill(sample_user_api.id, sample_another_user_api.id)
+        assert not sample_user_api.timeline.exists()
+
+    def test_feed_unauthenticated(self):
+        """Тест ленты для анонимного пользователя."""
+        client = APIClient()
+        response = client.get('/api/recipes/feed/')
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_ordering_popular(self, sample_user_api, sample_recipe,
+                              sample_recipe_alt):
+        """Тест сортировки по популярности."""
+        Favorite.objects.create(user=sample_user_api,
+                                recipe=sample_recipe_alt)
+        update_popularity()
+
+        client = APIClient()
+        response = client.get('/api/recipes/?ordering=popular')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['id'] == sample_recipe_alt.id
+
+    def test_trending(self, sample_user_api, sample_recipe,
+                      sample_recipe_alt):
+        """Тест списка популярных рецептов."""
+        Favorite.objects.create(user=sample_user_api, recipe=sample_recipe)
+        update_popularity()
+
+        client = APIClient()
+        response = client.get('/api/recipes/trending/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+        assert response.data['results'][0]['id'] == sample_recipe.id
+
+        # Новые события видны только после следующего пересчёта
+        Favorite.objects.create(user=sample_user_api,
+                                recipe=sample_recipe_alt)
+        assert client.get('/api/recipes/trending/').data['count'] == 1
+        update_popularity()
+        assert client.get('/api/recipes/trending/').data['count'] == 2
+
+    def test_get_short_link(self, settings, sample_recipe, sample_recipe_alt,
+                            django_assert_num_queries):
+        """Тест короткой ссылки и перехода по ней."""
+        settings.SHORT_LINK_FLUSH_ASYNC = False
         client = APIClient()
         response = client.get(f'/api/recipes/{sample_recipe.id}/get_link/')
         assert response.status_code == status.HTTP_200_OK
-        assert 'short-link' in response.data
+        short_link = response.data['short-link']
+        code = short_link.rsplit('/', 1)[-1]
+        assert short_link == f'http://testserver/s/{code}'
+        assert len(code) == 6 and code.isalnum()
+        # Ссылка создаётся один раз, у разных рецептов коды разные
+        response = client.get(f'/api/recipes/{sample_recipe.id}/get_link/')
+        assert response.data['short-link'] == short_link
+        response = client.get(
+            f'/api/recipes/{sample_recipe_alt.id}/get_link/')
+        assert response.data['short-link'] != short_link
+
+        response = client.get(f'/s/{code}')
+        assert response.status_code == status.HTTP_302_FOUND
+        assert response['Location'] == f'/recipes/{sample_recipe.id}'
+        with django_assert_num_queries(0):
+            client.get(f'/s/{code}/')
+        assert client.get('/s/unknown').status_code == (
+            status.HTTP_404_NOT_FOUND)
+
+        # Переходы записываются в базу пачкой
+        link = ShortLink.objects.get(code=code)
+        assert link.clicks == 0
+        assert click_buffer.flush() == 2
+        link.refresh_from_db()
+        assert link.clicks == 2
+
+        # Ссылка удалённого рецепта больше не работает
+        sample_recipe.delete()
+        assert client.get(f'/s/{code}').status_code == (
+            status.HTTP_404_NOT_FOUND)
 
 
 @pytest.mark.django_db
@@ -215,7 +928,7 @@ class TestSubscriptionViewSet:
             f'/api/users/{sample_another_user_api.id}/subscribe/')
         assert response.status_code == status.HTTP_201_CREATED
         assert Subscription.objects.filter(
-            user=sample_user_api, 
+            user=sample_user_api,
             author=sample_another_user_api).exists()
 
     def test_subscribe_to_self(self, sample_user_api):
@@ -226,8 +939,8 @@ class TestSubscriptionViewSet:
         response = client.post(f'/api/users/{sample_user_api.id}/subscribe/')
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
-    def test_unsubscribe_success(self, sample_user_api, 
-                                 sample_another_user_api, 
+    def test_unsubscribe_success(self, sample_user_api,
+                                 sample_another_user_api,
                                  existing_subscription):
         """Тест успешной отписки."""
         client = APIClient()
@@ -237,9 +950,31 @@ class TestSubscriptionViewSet:
             f'/api/users/{sample_another_user_api.id}/subscribe/')
         assert response.status_code == status.HTTP_204_NO_CONTENT
         assert not Subscription.objects.filter(
-            user=sample_user_api, 
+            user=sample_user_api,
             author=sample_another_user_api).exists()
 
+    def test_bulk_subscribe(self, settings, sample_user_api,
+                            sample_another_user_api, sample_recipe_alt):
+        """Тест массовой подписки и отписки с обновлением ленты."""
+        settings.TIMELINE_BACKFILL_ASYNC = False
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        ids = [sample_another_user_api.id, sample_user_api.id, 999999]
+
+        response = client.post('/api/users/subscribe/',
+                               {'ids': ids}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['status'] for item in response.data['results']] == [
+            'added', 'self', 'not_found']
+        assert list(sample_user_api.timeline.values_list(
+            'recipe_id', flat=True)) == [sample_recipe_alt.id]
+
+        response = client.delete('/api/users/subscribe/',
+                                 {'ids': ids}, format='json')
+        assert [item['status'] for item in response.data['results']] == [
+            'removed', 'not_found', 'not_found']
+        assert not sample_user_api.timeline.exists()
+
     def test_get_subscriptions(self, sample_user_api, existing_subscription):
         """Тест получения подписок."""
         client = APIClient()
@@ -248,4 +983,210 @@ class TestSubscriptionViewSet:
         response = client.get('/api/users/subscriptions/')
         assert response.status_code == status.HTTP_200_OK
         assert 'results' in response.data
-        assert len(response.data['results']) == 1
\ No newline at end of file
+        assert len(response.data['results']) == 1
+
+    def test_subscriptions_recipes_limit(self, sample_user_api,
+                                         user_factory, sample_image,
+                                         django_assert_num_queries):
+        """Тест ограничения рецептов и числа запросов в подписках."""
+        authors = user_factory.create_batch(3)
+        published = timezone.now() - timedelta(days=1)
+        for author in authors:
+            Subscription.objects.create(user=sample_user_api, author=author)
+            for number in range(3):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {number}',
+                    image=sample_image,
+                    text='Описание',
+                    cooking_time=10
+                )
+                # pub_date заполняется при создании, порядок задаём явно
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    pub_date=published + timedelta(minutes=number))
+
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        with django_assert_num_queries(3):
+            response = client.get(
+                '/api/users/subscriptions/?recipes_limit=2')
+        assert response.status_code == status.HTTP_200_OK
+        for item in response.data['results']:
+            assert len(item['recipes']) == 2
+            assert item['recipes_count'] == 3
+            assert item['is_subscribed'] is True
+            assert item['recipes'][0]['name'] == 'Рецепт 2'
+
+
+@pytest.mark.django_db
+class TestRecipeEventStream:
+    """Тесты для потока событий о новых рецептах."""
+
+    def _run(self, token_key, publish):
+        messages = []
+
+        async def scenario():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message['type'] == 'http.response.start':
+                    if message['status'] == 200:
+                        for event in publish:
+                            hub.dispatch(event)
+                elif message.get('more_body'):
+                    disconnect.set()
+
+            scope = {
+                'type': 'http',
+                'path': '/api/recipes/stream/',
+                'query_string': f'token={token_key}'.encode(),
+                'headers': [],
+            }
+            await asyncio.wait_for(application(scope, receive, send), 5)
+
+        async_to_sync(scenario)()
+        return messages
+
+    def test_stream_followed_author(self, sample_user_api,
+                                    existing_subscription):
+        """Событие от автора из подписок приходит в поток."""
+        token = Token.objects.create(user=sample_user_api)
+        author_id = existing_subscription.author_id
+        messages = self._run(token.key, [
+            {'id': 1, 'author': sample_user_api.id, 'name': 'Чужой'},
+            {'id': 2, 'author': author_id, 'name': 'Суп'},
+        ])
+        assert messages[0]['status'] == status.HTTP_200_OK
+        body = messages[1]['body'].decode()
+        assert 'event: recipe' in body
+        assert '"name": "Суп"' in body
+
+    def test_stream_invalid_token(self):
+        """Поток недоступен без действующего токена."""
+        messages = self._run('invalid', [])
+        assert messages[0]['status'] == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+class TestBatchView:
+    """Тесты пакетных запросов."""
+
+    def test_batch(self, sample_user_api, sample_recipe_alt):
+        """Подзапросы выполняются от имени пользователя по порядку."""
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        recipe_id = sample_recipe_alt.id
+        response = client.post('/api/batch/', {'requests': [
+            {'method': 'post', 'path': f'/api/recipes/{recipe_id}/favorite/'},
+            {'method': 'GET', 'path': f'/api/recipes/{recipe_id}/'},
+            {'method': 'GET', 'path': '/api/users/me/'},
+            {'method': 'GET', 'path': '/api/unknown/'},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.data['responses']
+        assert [item['status'] for item in results] == [201, 200, 200, 404]
+        assert results[1]['body']['is_favorited'] is True
+        assert results[2]['body']['id'] == sample_user_api.id
+
+    def test_batch_limits(self, settings):
+        """Размер пакета ограничен, вложенные пакеты запрещены."""
+        settings.BATCH_MAX_REQUESTS = 1
+        client = APIClient()
+        response = client.post('/api/batch/', {'requests': [
+            {'method': 'GET', 'path': '/api/recipes/'},
+            {'method': 'GET', 'path': '/api/ingredients/'},
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = client.post('/api/batch/', {'requests': [
+            {'method': 'POST', 'path': '/api/batch/'},
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.django_db(transaction=True)
+    def test_batch_parallel(self, sample_recipe):
+        """Подряд идущие GET-подзапросы выполняются в пуле потоков."""
+        client = APIClient()
+        response = client.post('/api/batch/', {'parallel': True, 'requests': [
+            {'method': 'GET', 'path': f'/api/recipes/{sample_recipe.id}/'},
+            {'method': 'GET', 'path': '/api/recipes/?limit=1'},
+        ]}, format='json')
+        results = response.data['responses']
+        assert [item['status'] for item in results] == [200, 200]
+        assert results[1]['body']['results'][0]['id'] == sample_recipe.id
+
+
+@pytest.mark.django_db
+class TestFastJSON:
+    """Тесты JSON-рендерера и парсера на orjson."""
+
+    def test_renderer_matches_stdlib(self, sample_recipe):
+        """Ответ совпадает с ответом стандартного рендерера."""
+        response = APIClient().get('/api/recipes/')
+        assert response['Content-Type'] == 'application/json'
+        data = {**response.data, 'price': Decimal('1.5'),
+                'title': gettext_lazy('Рецепты')}
+        assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+
+    def test_parser_errors(self, sample_user_api):
+        """Некорректный JSON в запросе даёт ошибку 400."""
+        client = APIClient()
+        client.force_authenticate(user=sample_user_api)
+        response = client.post('/api/recipes/favorite/', '{"ids": [',
+                               content_type='application/json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_benchmark_command(self, sample_recipe):
+        """Команда сравнения рендереров выводит оба результата."""
+        out = StringIO()
+        call_command('benchmark_json', repeat=2, stdout=out)
+        assert 'JSONRenderer' in out.getvalue()
+        assert 'FastJSONRenderer' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestCompression:
+    """Тесты сжатия ответов."""
+
+    def test_gzip_cached_response(self, sample_recipe):
+        """Сжатое тело кэшированного ответа повторно не вычисляется."""
+        sample_recipe.text = 'Очень подробное описание. ' * 100
+        sample_recipe.save()
+        client = APIClient()
+
+        first = client.get(
+            '/api/recipes/', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        assert first['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in first['Vary']
+        assert first['ETag'].startswith('W/"')
+        data = json.loads(gzip.decompress(first.content))
+        assert data['results'][0]['text'] == sample_recipe.text
+
+        second = client.get('/api/recipes/', HTTP_ACCEPT_ENCODING='gzip')
+        assert second['X-Cache'] == 'HIT'
+        assert second.content == first.content
+        assert compressed_bodies.hits == 1
+
+    def test_small_or_unaccepted_not_compressed(self, sample_recipe):
+        """Маленькие ответы и ответы без Accept-Encoding не сжимаются."""
+        client = APIClient()
+        response = client.get(f'/api/recipes/{sample_recipe.id}/?fields=id',
+                              HTTP_ACCEPT_ENCODING='gzip')
+        assert not response.has_header('Content-Encoding')
+        response = client.get('/api/recipes/', HTTP_ACCEPT_ENCODING='identity')
+        assert not response.has_header('Content-Encoding')
+
+    def test_html_not_compressed(self, settings):
+        """Страницы с CSRF-токеном не сжимаются (BREACH)."""
+        response = APIClient().get('/admin/login/',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        assert response.status_code == status.HTTP_200_OK
+        assert 'csrfmiddlewaretoken' in response.content.decode()
+        assert len(response.content) >= settings.COMPRESSION_MIN_SIZE
+        assert not response.has_header('Content-Encoding')
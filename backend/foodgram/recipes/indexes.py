@@ -0,0 +1,320 @@
+"""
+Инвертированный индекс «ингредиент → рецепты» для фильтра по ингредиентам.
+
+Индекс хранится в памяти процесса в формате CSR: отсортированный массив
+id ингредиентов, смещения и общий массив id рецептов, отсортированных
+внутри каждого ингредиента. Пересечение и объединение таких массивов
+выполняется numpy без обращения к базе.
+
+Для подбора рецептов по имеющимся продуктам (``recipe_matrix``) те же
+данные хранятся по рецептам: матрица «рецепт × ингредиент» с количествами.
+
+Изменение ингредиентов рецептов меняет версию индексов в общем кэше.
+Устаревший индекс перестраивается в фоновом потоке, но не чаще
+INGREDIENT_INDEX_REBUILD_INTERVAL секунд. Синхронно строится только
+первый снимок процесса. Пока снимок устарел, а также без numpy или при
+выключенном индексе фильтр выполняется SQL-запросом; подбор по
+продуктам до замены использует прежний снимок.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef
+
+from .models import RecipeIngredient
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_VERSION_KEY = "recipes:ingredient_index:version"
+BATCH_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="ingredient-index")
+
+Snapshot = namedtuple(
+    "Snapshot", "version built_at ingredient_ids offsets recipe_ids")
+MatrixSnapshot = namedtuple(
+    "MatrixSnapshot",
+    "version built_at ingredient_ids offsets recipe_rows amounts "
+    "recipe_ids totals")
+
+
+def get_index_version():
+    cache.add(INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+    return cache.get(INDEX_VERSION_KEY)
+
+
+def bump_index_version():
+    """Помечает индекс устаревшим сейчас и после фиксации транзакции."""
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    cache.set(INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class VersionedIndex:
+    """
+    Снимок данных в памяти процесса, перестраиваемый при смене версии
+    индекса ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._rebuilding = False
+
+    def get_snapshot(self, allow_stale=True):
+        """
+        Снимок данных. Устаревший снимок перестраивается в фоне, а без
+        ``allow_stale`` вместо него возвращается None.
+        """
+        version = get_index_version()
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self.build(version)
+                return self._snapshot
+        if self._is_stale(snapshot, version):
+            self.schedule_rebuild(version)
+            # Без фонового перестроения снимок уже заменён
+            snapshot = self._snapshot
+        if not allow_stale and snapshot.version != version:
+            return None
+        return snapshot
+
+    def schedule_rebuild(self, version):
+        """
+        Перестраивает снимок в фоновом потоке, одновременно — не больше
+        одного перестроения.
+        """
+        if not getattr(settings, "INGREDIENT_INDEX_REBUILD_ASYNC", True):
+            with self._lock:
+                if self._is_stale(self._snapshot, version):
+                    self._snapshot = self.build(version)
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        _executor.submit(self._run_rebuild, version)
+
+    def _run_rebuild(self, version):
+        try:
+            snapshot = self.build(version)
+            with self._lock:
+                self._snapshot = snapshot
+        except Exception:
+            logger.exception("%s rebuild failed", type(self).__name__)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+            # Соединение фонового потока не должно оставаться открытым
+            connection.close()
+
+    @staticmethod
+    def _is_stale(snapshot, version):
+        if snapshot is None:
+            return True
+        return snapshot.version != version and (
+            time.monotonic() - snapshot.built_at
+            >= settings.INGREDIENT_INDEX_REBUILD_INTERVAL
+        )
+
+    def build(self, version):
+        raise NotImplementedError
+
+
+class IngredientIndex(VersionedIndex):
+
+    @staticmethod
+    def is_available():
+        return np is not None and settings.INGREDIENT_INDEX_ENABLED
+
+    @staticmethod
+    def build(version):
+        rows = RecipeIngredient.objects.order_by(
+            "ingredient_id", "recipe_id"
+        ).values_list("ingredient_id", "recipe_id").iterator(
+            chunk_size=BATCH_SIZE)
+        pairs = np.fromiter(
+            itertools.chain.from_iterable(rows), dtype=np.int64
+        ).reshape(-1, 2)
+        ingredient_ids, starts = np.unique(pairs[:, 0], return_index=True)
+        return Snapshot(
+            version=version,
+            built_at=time.monotonic(),
+            ingredient_ids=ingredient_ids,
+            offsets=np.append(starts, len(pairs)),
+            recipe_ids=np.ascontiguousarray(pairs[:, 1]),
+        )
+
+    @staticmethod
+    def postings(snapshot, ingredient_id):
+        """Отсортированные id рецептов с ингредиентом."""
+        position = np.searchsorted(snapshot.ingredient_ids, ingredient_id)
+        if (
+            position == len(snapshot.ingredient_ids)
+            or snapshot.ingredient_ids[position] != ingredient_id
+        ):
+            return snapshot.recipe_ids[:0]
+        return snapshot.recipe_ids[
+            snapshot.offsets[position]:snapshot.offsets[position + 1]]
+
+    def match(self, include, match_any=False, exclude=()):
+        """
+        Отсортированный массив id рецептов со всеми (или, при
+        ``match_any``, с любым) ингредиентами из ``include`` и без
+        ингредиентов из ``exclude``. None, если индекс устарел.
+        """
+        snapshot = self.get_snapshot(allow_stale=False)
+        if snapshot is None:
+            return None
+        postings = sorted(
+            (self.postings(snapshot, pk) for pk in include), key=len)
+        if match_any:
+            result = np.unique(np.concatenate(postings))
+        else:
+            # Пересечение начинается с самого короткого списка
+            result = postings[0]
+            for other in postings[1:]:
+                if not len(result):
+                    break
+                result = np.intersect1d(result, other, assume_unique=True)
+        for pk in exclude:
+            if not len(result):
+                break
+            result = np.setdiff1d(
+                result, self.postings(snapshot, pk), assume_unique=True)
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+class RecipeMatrix(VersionedIndex):
+    """
+    Разреженная матрица «рецепт × ингредиент» с количествами, хранимая
+    по столбцам (CSC): для каждого ингредиента — номера строк рецептов
+    и количества. Подбор затрагивает только столбцы имеющихся продуктов.
+    """
+
+    @staticmethod
+    def build(version):
+        rows = RecipeIngredient.objects.order_by(
+            "ingredient_id", "recipe_id"
+        ).values_list("ingredient_id", "recipe_id", "amount").iterator(
+            chunk_size=BATCH_SIZE)
+        entries = np.fromiter(
+            itertools.chain.from_iterable(rows), dtype=np.int64
+        ).reshape(-1, 3)
+        ingredient_ids, starts = np.unique(entries[:, 0], return_index=True)
+        recipe_ids, recipe_rows = np.unique(
+            entries[:, 1], return_inverse=True)
+        return MatrixSnapshot(
+            version=version,
+            built_at=time.monotonic(),
+            ingredient_ids=ingredient_ids,
+            offsets=np.append(starts, len(entries)),
+            recipe_rows=recipe_rows.astype(np.int32),
+            amounts=entries[:, 2].astype(np.float64),
+            recipe_ids=recipe_ids,
+            totals=np.bincount(recipe_rows, minlength=len(recipe_ids)),
+        )
+
+    def match(self, pantry, limit, min_coverage=0.0):
+        """
+        Лучшие рецепты для продуктов ``pantry`` ({id ингредиента:
+        количество или None, если его достаточно}).
+
+        Возвращает список (id рецепта, доля имеющихся ингредиентов,
+        число недостающих, средняя нехватка количества) по убыванию
+        доли, затем по возрастанию недостающих и нехватки. Недостающий
+        ингредиент считается нехваткой 1.
+        """
+        snapshot = self.get_snapshot()
+        rows, shortages = [], []
+        for ingredient_id, amount in pantry.items():
+            position = np.searchsorted(snapshot.ingredient_ids, ingredient_id)
+            if (
+                position == len(snapshot.ingredient_ids)
+                or snapshot.ingredient_ids[position] != ingredient_id
+            ):
+                continue
+            column = slice(snapshot.offsets[position],
+                           snapshot.offsets[position + 1])
+            rows.append(snapshot.recipe_rows[column])
+            if amount is None:
+                shortages.append(np.zeros(len(rows[-1])))
+            else:
+                shortages.append(np.clip(
+                    1.0 - amount / snapshot.amounts[column], 0.0, None))
+        if not rows:
+            return []
+
+        rows = np.concatenate(rows)
+        candidates, inverse, covered = np.unique(
+            rows, return_inverse=True, return_counts=True)
+        total = snapshot.totals[candidates]
+        missing = total - covered
+        coverage = covered / total
+        shortfall = (np.bincount(
+            inverse, weights=np.concatenate(shortages),
+            minlength=len(candidates)) + missing) / total
+
+        selected = coverage >= min_coverage
+        candidates, coverage, missing, shortfall = (
+            candidates[selected], coverage[selected],
+            missing[selected], shortfall[selected])
+        order = np.lexsort((shortfall, missing, -coverage))[:limit]
+        return list(zip(
+            snapshot.recipe_ids[candidates[order]].tolist(),
+            coverage[order].tolist(),
+            missing[order].tolist(),
+            shortfall[order].tolist(),
+        ))
+
+
+recipe_matrix = RecipeMatrix()
+
+
+def filter_by_ingredients(queryset, include=(), match_any=False, exclude=()):
+    """Фильтр рецептов по ингредиентам: индекс или SQL."""
+    if include and ingredient_index.is_available():
+        ids = ingredient_index.match(include, match_any, exclude)
+        if ids is not None and len(ids) <= settings.INGREDIENT_INDEX_MAX_IDS:
+            return queryset.filter(pk__in=ids.tolist())
+    return filter_by_ingredients_sql(queryset, include, match_any, exclude)
+
+
+def filter_by_ingredients_sql(queryset, include=(), match_any=False,
+                              exclude=()):
+    if include:
+        matches = RecipeIngredient.objects.filter(ingredient_id__in=include)
+        if match_any:
+            queryset = queryset.filter(
+                Exists(matches.filter(recipe_id=OuterRef("pk"))))
+        else:
+            queryset = queryset.filter(pk__in=matches.order_by().values(
+                "recipe_id"
+            ).annotate(
+                matched=Count("ingredient_id")
+            ).filter(matched=len(set(include))).values("recipe_id"))
+    if exclude:
+        queryset = queryset.filter(~Exists(RecipeIngredient.objects.filter(
+            recipe_id=OuterRef("pk"), ingredient_id__in=exclude)))
+    return queryset
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import CHUNK_NNZ, NEIGHBOURS, build_neighbours
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает соседей рецептов по совместному добавлению "
+        "в избранное. Предназначена для ночного запуска (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=NEIGHBOURS,
+            help="Сколько соседей хранить для каждого рецепта.",
+        )
+        parser.add_argument(
+            "--chunk-nnz",
+            type=int,
+            default=CHUNK_NNZ,
+            help="Предельное число ненулевых элементов в блоке матрицы.",
+        )
+
+    def handle(self, *args, **options):
+        count = build_neighbours(
+            top_n=options["top"], max_nnz=options["chunk_nnz"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Найдены соседи {count} рецептов"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит заново MinHash-сигнатуры и LSH-индекс похожих рецептов. "
+        "Текущие изменения ингредиентов индекс учитывает сам."
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Построены сигнатуры {count} рецептов"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes.popularity import update_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает рейтинг популярности рецептов. "
+        "Предназначена для периодического запуска (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Построить рейтинг заново по всем событиям.",
+        )
+
+    def handle(self, *args, **options):
+        updated = update_popularity(full=options["full"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Обновлён рейтинг {updated} рецептов"))
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.16 on 2026-10-19 07:47
+
+import django.core.validators
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_alter_recipe_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('processed_until', models.DateTimeField(verbose_name='Учтено до')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка рейтинга',
+                'verbose_name_plural': 'Контрольные точки рейтинга',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='favorite',
+            options={'ordering': ['recipe'], 'verbose_name': 'Избранное', 'verbose_name_plural': 'Избранные'},
+        ),
+        migrations.AlterModelOptions(
+            name='ingredient',
+            options={'ordering': ['name'], 'verbose_name': 'Ингредиент', 'verbose_name_plural': 'Ингредиенты'},
+        ),
+        migrations.AlterModelOptions(
+            name='recipeingredient',
+            options={'ordering': ['recipe'], 'verbose_name': 'Ингредиент в рецепте', 'verbose_name_plural': 'Ингредиенты в рецептах'},
+        ),
+        migrations.AlterModelOptions(
+            name='shoppingcart',
+            options={'ordering': ['recipe'], 'verbose_name': 'Список покупок', 'verbose_name_plural': 'Списки покупок'},
+        ),
+        migrations.AlterModelOptions(
+            name='subscription',
+            options={'ordering': ['author'], 'verbose_name': 'Подписка', 'verbose_name_plural': 'Подписки'},
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity',
+            field=models.FloatField(db_index=True, default=0, help_text='Затухающий во времени рейтинг, пересчитывается командой update_popularity', verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MaxValueValidator(32000), django.core.validators.MinValueValidator(1)], verbose_name='Время приготовления (мин)'),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MaxValueValidator(32000), django.core.validators.MinValueValidator(1)], verbose_name='Количество'),
+        ),
+    ]
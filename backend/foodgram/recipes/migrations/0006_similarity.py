@@ -0,0 +1,46 @@
+# Generated by Django 3.2.16 on 2026-10-19 08:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSignature',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('minhash', models.BinaryField(verbose_name='Сигнатура')),
+            ],
+            options={
+                'verbose_name': 'Сигнатура рецепта',
+                'verbose_name_plural': 'Сигнатуры рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField(verbose_name='Полоса')),
+                ('bucket', models.BigIntegerField(verbose_name='Корзина')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Корзина LSH',
+                'verbose_name_plural': 'Корзины LSH',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipebucket',
+            index=models.Index(fields=['band', 'bucket'], name='recipe_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipebucket',
+            constraint=models.UniqueConstraint(fields=('recipe', 'band'), name='unique_recipe_band'),
+        ),
+    ]
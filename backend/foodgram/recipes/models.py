@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import connections, models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 
@@ -59,11 +60,33 @@ class Recipe(models.Model):
         auto_now_add=True, 
         verbose_name="Дата публикации"
     )
+    popularity = models.FloatField(
+        default=0,
+        db_index=True,
+        verbose_name="Популярность",
+        help_text="Затухающий во времени рейтинг, "
+                  "пересчитывается командой update_popularity"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Дата изменения"
+    )
 
     class Meta:
         ordering = ["-pub_date"]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            # Рецепты автора по дате и фильтр по времени приготовления
+            models.Index(
+                fields=["author", "-pub_date"], name="recipe_author_date_idx"
+            ),
+            models.Index(
+                fields=["cooking_time", "pub_date"],
+                name="recipe_time_date_idx",
+            ),
+        ]
         
 
     def __str__(self):
@@ -111,6 +134,84 @@ class RecipeIngredient(models.Model):
         return f" {self.recipe}: {self.ingredient} - {self.amount}"
 
 
+class UserLinkManager(models.Manager):
+    """
+    Менеджер связей пользователя с рецептами или авторами (избранное,
+    список покупок, подписки).
+
+    Массовые операции выполняются одним запросом и не отправляют
+    сигналы моделей.
+    """
+
+    def __init__(self, target="recipe"):
+        super().__init__()
+        self.target = target
+
+    def add(self, user, obj):
+        """
+        Добавляет связь одним запросом.
+
+        Повторное добавление отсекает уникальное ограничение базы,
+        поэтому одновременные запросы не приводят к ошибке.
+        Возвращает False, если связь уже была.
+        """
+        return bool(self.add_many(user, [obj.pk]))
+
+    def add_many(self, user, ids):
+        """
+        Связывает пользователя с существующими объектами из списка
+        запросом INSERT ... SELECT и возвращает id добавленных.
+        """
+        if not ids:
+            return set()
+        connection = connections[self.db]
+        opts = self.model._meta
+        quote = connection.ops.quote_name
+        target_field = opts.get_field(self.target)
+        names = ["user", self.target]
+        values = ["%s", quote(target_field.target_field.column)]
+        params = [user.pk]
+        if any(field.name == "created_at" for field in opts.fields):
+            names.append("created_at")
+            values.append("%s")
+            params.append(opts.get_field("created_at").get_db_prep_save(
+                timezone.now(), connection))
+        columns = ", ".join(
+            quote(opts.get_field(name).column) for name in names)
+        placeholders = ", ".join(["%s"] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(opts.db_table)} ({columns}) "
+                f"SELECT {', '.join(values)} "
+                f"FROM {quote(target_field.related_model._meta.db_table)} "
+                f"WHERE {quote(target_field.target_field.column)} "
+                f"IN ({placeholders}) "
+                f"ON CONFLICT DO NOTHING "
+                f"RETURNING {quote(target_field.column)}",
+                [*params, *ids],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def remove_many(self, user, ids):
+        """Удаляет связи пользователя и возвращает id удалённых."""
+        if not ids:
+            return set()
+        connection = connections[self.db]
+        opts = self.model._meta
+        quote = connection.ops.quote_name
+        target_column = quote(opts.get_field(self.target).column)
+        placeholders = ", ".join(["%s"] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {quote(opts.db_table)} "
+                f"WHERE {quote(opts.get_field('user').column)} = %s "
+                f"AND {target_column} IN ({placeholders}) "
+                f"RETURNING {target_column}",
+                [user.pk, *ids],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+
 class ShoppingCart(models.Model):
     user = models.ForeignKey(
         User,
@@ -124,6 +225,13 @@ class ShoppingCart(models.Model):
         related_name="shopping_cart",
         verbose_name="Рецепт",
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name="Дата добавления"
+    )
+
+    objects = UserLinkManager()
 
     class Meta:
         verbose_name = "Список покупок"
@@ -152,6 +260,13 @@ class Favorite(models.Model):
         related_name="favorites",
         verbose_name="Рецепт",
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name="Дата добавления"
+    )
+
+    objects = UserLinkManager()
 
     class Meta:
         verbose_name = "Избранное"
@@ -160,6 +275,16 @@ class Favorite(models.Model):
             models.UniqueConstraint(fields=["user", "recipe"], 
                                     name="unique_favorite")
         ]
+        indexes = [
+            # Уникальный индекс (user, recipe) покрывает флаги и фильтр
+            # избранного, этот — последние избранные рецепты пользователя
+            # (на PostgreSQL оба читаются без обращения к таблице)
+            models.Index(
+                fields=["user", "-created_at"],
+                include=["recipe"],
+                name="favorite_user_recent_idx",
+            )
+        ]
         ordering = ["recipe"]
 
     def __str__(self):
@@ -178,7 +303,9 @@ class Subscription(models.Model):
         related_name="following", 
         verbose_name="Автор"
     )
- 
+
+    objects = UserLinkManager(target="author")
+
     class Meta:
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"
@@ -191,3 +318,173 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.user} подписан на {self.author}"
+
+
+class ScoreCheckpoint(models.Model):
+    """Момент, до которого события уже учтены в пересчёте рейтинга."""
+
+    name = models.CharField(
+        max_length=50, unique=True, verbose_name="Название")
+    processed_until = models.DateTimeField(verbose_name="Учтено до")
+
+    class Meta:
+        verbose_name = "Контрольная точка рейтинга"
+        verbose_name_plural = "Контрольные точки рейтинга"
+
+    def __str__(self):
+        return f"{self.name}: {self.processed_until}"
+
+
+class TimelineEntry(models.Model):
+    """
+    Запись ленты подписок пользователя.
+
+    Ленты заполняются при публикации рецепта (fan-out on write),
+    поэтому чтение ленты — это один проход по индексу (user, -pub_date).
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline",
+        verbose_name="Пользователь",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Автор",
+    )
+    pub_date = models.DateTimeField(verbose_name="Дата публикации")
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Ленты подписок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique_timeline_entry"
+            )
+        ]
+        indexes = [
+            # id различает записи с одинаковой датой (FeedPagination)
+            models.Index(
+                fields=["user", "-pub_date", "-id"],
+                name="timeline_user_date_idx",
+            )
+        ]
+        ordering = ["-pub_date", "-id"]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
+
+
+class RecipeSignature(models.Model):
+    """MinHash-сигнатура набора ингредиентов рецепта (recipes.similarity)."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="signature",
+        verbose_name="Рецепт",
+    )
+    minhash = models.BinaryField(verbose_name="Сигнатура")
+
+    class Meta:
+        verbose_name = "Сигнатура рецепта"
+        verbose_name_plural = "Сигнатуры рецептов"
+
+    def __str__(self):
+        return f"{self.recipe_id}"
+
+
+class RecipeBucket(models.Model):
+    """Корзина LSH-индекса: рецепты с совпадающей полосой сигнатуры."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Рецепт",
+    )
+    band = models.PositiveSmallIntegerField(verbose_name="Полоса")
+    bucket = models.BigIntegerField(verbose_name="Корзина")
+
+    class Meta:
+        verbose_name = "Корзина LSH"
+        verbose_name_plural = "Корзины LSH"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipe", "band"], name="unique_recipe_band"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["band", "bucket"], name="recipe_bucket_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.band}:{self.bucket} -> {self.recipe_id}"
+
+
+class RecipeNeighbour(models.Model):
+    """
+    Рецепт, который часто добавляют в избранное вместе с данным
+    (recipes.recommendations).
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="neighbours",
+        verbose_name="Рецепт",
+    )
+    neighbour = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Похожий рецепт",
+    )
+    score = models.FloatField(verbose_name="Сходство")
+
+    class Meta:
+        verbose_name = "Соседний рецепт"
+        verbose_name_plural = "Соседние рецепты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipe", "neighbour"], name="unique_recipe_neighbour"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} → {self.neighbour_id}"
+
+
+class ShortLink(models.Model):
+    """Короткая ссылка /s/<code> на рецепт (api.shortlinks)."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="short_link",
+        verbose_name="Рецепт",
+    )
+    code = models.CharField(max_length=16, unique=True, verbose_name="Код")
+    clicks = models.PositiveBigIntegerField(
+        default=0, verbose_name="Переходы")
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Короткая ссылка"
+        verbose_name_plural = "Короткие ссылки"
+
+    def __str__(self):
+        return self.code
@@ -0,0 +1,120 @@
+"""
+Затухающий во времени рейтинг рецептов.
+
+Каждое добавление в избранное или в список покупок вносит в рейтинг
+вклад ``weight * 2 ** ((t - EPOCH) / half_life)``. Рейтинги всех рецептов
+затухают с одинаковой скоростью, поэтому порядок по такой сумме совпадает
+с порядком по «честному» затухающему рейтингу на любой момент времени,
+и уже посчитанные значения не нужно пересчитывать — достаточно добавить
+вклад новых событий. Чтобы не переполнить float, в колонке
+``Recipe.popularity`` хранится натуральный логарифм суммы.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ScoreCheckpoint, ShoppingCart
+
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+CHECKPOINT_NAME = "popularity"
+TRENDING_VERSION_KEY = "recipes:trending:version"
+EVENT_WEIGHTS = (
+    (Favorite, 1.0),
+    (ShoppingCart, 0.5),
+)
+BATCH_SIZE = 1000
+
+
+def _half_life():
+    hours = getattr(settings, "POPULARITY_HALF_LIFE_HOURS", 72)
+    return timedelta(hours=hours).total_seconds()
+
+
+def event_score(created_at, weight):
+    """Логарифм вклада одного события в рейтинг."""
+    age = (created_at - EPOCH).total_seconds()
+    return math.log(weight) + age / _half_life() * math.log(2)
+
+
+def log_add(a, b):
+    """Устойчивое вычисление log(exp(a) + exp(b))."""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def collect_scores(since=None, until=None):
+    """Суммирует вклад событий из интервала (since, until] по рецептам."""
+    scores = {}
+    for model, weight in EVENT_WEIGHTS:
+        events = model.objects.all()
+        if since is not None:
+            events = events.filter(created_at__gt=since)
+        if until is not None:
+            events = events.filter(created_at__lte=until)
+        rows = events.order_by().values_list(
+            "recipe_id", "created_at").iterator(chunk_size=BATCH_SIZE)
+        for recipe_id, created_at in rows:
+            score = event_score(created_at, weight)
+            current = scores.get(recipe_id)
+            scores[recipe_id] = (
+                score if current is None else log_add(current, score))
+    return scores
+
+
+def update_popularity(full=False):
+    """
+    Пересчитывает рейтинг и возвращает количество обновлённых рецептов.
+
+    По умолчанию учитываются только события после предыдущего запуска.
+    При ``full=True`` рейтинг строится заново — это нужно, чтобы учесть
+    удалённые из избранного и списка покупок рецепты.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        checkpoint, created = (
+            ScoreCheckpoint.objects.select_for_update().get_or_create(
+                name=CHECKPOINT_NAME,
+                defaults={"processed_until": now},
+            )
+        )
+        since = None if full or created else checkpoint.processed_until
+        scores = collect_scores(since=since, until=now)
+
+        if since is None:
+            Recipe.objects.exclude(popularity=0).update(popularity=0)
+        recipes = []
+        ids = list(scores)
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = Recipe.objects.filter(
+                id__in=ids[start:start + BATCH_SIZE]).only("id", "popularity")
+            for recipe in batch:
+                score = scores[recipe.id]
+                # 0 означает «событий не было», его не складываем.
+                if recipe.popularity > 0:
+                    score = log_add(recipe.popularity, score)
+                recipe.popularity = score
+                recipes.append(recipe)
+        Recipe.objects.bulk_update(
+            recipes, ["popularity"], batch_size=BATCH_SIZE)
+
+        checkpoint.processed_until = now
+        checkpoint.save(update_fields=["processed_until"])
+
+    bump_trending_version()
+    return len(recipes)
+
+
+def get_trending_version():
+    return cache.get_or_set(TRENDING_VERSION_KEY, 1, timeout=None)
+
+
+def bump_trending_version():
+    try:
+        cache.incr(TRENDING_VERSION_KEY)
+    except ValueError:
+        cache.set(TRENDING_VERSION_KEY, 1, timeout=None)
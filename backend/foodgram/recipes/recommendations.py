@@ -0,0 +1,154 @@
+"""
+Рекомендации рецептов по совместному добавлению в избранное.
+
+Ночная задача (команда build_neighbours) строит разреженную матрицу
+«пользователь × рецепт» по Favorite и считает косинусное сходство
+столбцов: ``S = Xᵀ X`` с нормированными столбцами. Произведение
+считается блоками строк, размер блока подбирается по оценке числа
+ненулевых элементов, поэтому память ограничена при любом размере
+каталога. Для каждого рецепта сохраняются NEIGHBOURS лучших соседей
+(RecipeNeighbour).
+
+Рекомендации пользователю — соседи его последних избранных рецептов,
+ранжированные по сумме сходства; это один запрос к RecipeNeighbour.
+"""
+import itertools
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from scipy import sparse
+
+from .models import Favorite, RecipeNeighbour
+
+NEIGHBOURS = 20
+CHUNK_NNZ = 20_000_000
+RECENT_FAVORITES = 200
+BATCH_SIZE = 10000
+VERSION_KEY = "recipes:recommendations:version"
+
+
+def get_version():
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+    return cache.get(VERSION_KEY)
+
+
+def load_favorites():
+    """
+    Матрица «пользователь × рецепт» и id рецептов её столбцов.
+    Пользователи с одним избранным рецептом сходства не дают и
+    отбрасываются.
+    """
+    rows = Favorite.objects.order_by().values_list(
+        "user_id", "recipe_id").iterator(chunk_size=BATCH_SIZE)
+    pairs = np.fromiter(
+        itertools.chain.from_iterable(rows), dtype=np.int64
+    ).reshape(-1, 2)
+    _, users, user_counts = np.unique(
+        pairs[:, 0], return_inverse=True, return_counts=True)
+    pairs = pairs[user_counts[users] > 1]
+    _, users = np.unique(pairs[:, 0], return_inverse=True)
+    recipe_ids, recipes = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (users, recipes)),
+        shape=(users.max(initial=-1) + 1, len(recipe_ids)),
+    )
+    return matrix, recipe_ids
+
+
+def chunk_bounds(matrix, max_nnz):
+    """
+    Границы блоков строк ``Xᵀ`` так, чтобы оценка числа ненулевых
+    элементов произведения блока на ``X`` не превышала ``max_nnz``.
+    """
+    user_degrees = np.diff(matrix.indptr)
+    # Рецепт даёт не больше слагаемых, чем сумма степеней его пользователей
+    cost = np.cumsum(matrix.T @ user_degrees)
+    bounds = [0]
+    while bounds[-1] < len(cost):
+        spent = cost[bounds[-1] - 1] if bounds[-1] else 0
+        end = int(np.searchsorted(cost, spent + max_nnz, side="right"))
+        bounds.append(max(end, bounds[-1] + 1))
+    return bounds
+
+
+def top_neighbours(block, start, top_n):
+    """Лучшие соседи каждой строки блока матрицы сходства."""
+    for row in range(block.shape[0]):
+        begin, end = block.indptr[row], block.indptr[row + 1]
+        columns = block.indices[begin:end]
+        scores = block.data[begin:end]
+        own = columns != start + row
+        columns, scores = columns[own], scores[own]
+        if len(scores) > top_n:
+            best = np.argpartition(-scores, top_n)[:top_n]
+            columns, scores = columns[best], scores[best]
+        yield row, columns, scores
+
+
+def build_neighbours(top_n=NEIGHBOURS, max_nnz=CHUNK_NNZ):
+    """
+    Пересчитывает соседей всех рецептов, возвращает число рецептов
+    с соседями.
+    """
+    matrix, recipe_ids = load_favorites()
+    norms = np.sqrt(np.asarray(matrix.sum(axis=0)).ravel())
+    normalized = (matrix @ sparse.diags(1 / norms, format="csr")).tocsc()
+    transposed = normalized.T.tocsr()
+
+    built = 0
+    bounds = chunk_bounds(matrix, max_nnz)
+    for start, end in zip(bounds, bounds[1:]):
+        block = (transposed[start:end] @ normalized).tocsr()
+        neighbours = []
+        for row, columns, scores in top_neighbours(block, start, top_n):
+            recipe_id = int(recipe_ids[start + row])
+            built += bool(len(columns))
+            neighbours.extend(
+                RecipeNeighbour(recipe_id=recipe_id,
+                                neighbour_id=int(neighbour_id),
+                                score=float(score))
+                for neighbour_id, score in zip(recipe_ids[columns], scores)
+            )
+        with transaction.atomic():
+            RecipeNeighbour.objects.filter(
+                recipe_id__in=recipe_ids[start:end].tolist()).delete()
+            RecipeNeighbour.objects.bulk_create(
+                neighbours, batch_size=BATCH_SIZE)
+
+    # Рецепты, которые больше никто не добавляет в избранное вместе
+    # с другими
+    stale = set(RecipeNeighbour.objects.values_list(
+        "recipe_id", flat=True).distinct()) - set(recipe_ids.tolist())
+    stale = list(stale)
+    for start in range(0, len(stale), BATCH_SIZE):
+        RecipeNeighbour.objects.filter(
+            recipe_id__in=stale[start:start + BATCH_SIZE]).delete()
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    return built
+
+
+def recommend(user, limit):
+    """
+    Id рекомендуемых пользователю рецептов по убыванию суммарного
+    сходства с его последними избранными рецептами. Избранные и
+    собственные рецепты пользователя не рекомендуются.
+    """
+    favorites = list(Favorite.objects.filter(user=user).order_by(
+        "-created_at").values_list("recipe_id", flat=True))
+    if not favorites:
+        return []
+    return list(
+        RecipeNeighbour.objects.filter(
+            recipe_id__in=favorites[:RECENT_FAVORITES]
+        ).exclude(
+            neighbour_id__in=favorites
+        ).exclude(
+            neighbour__author=user
+        ).values("neighbour_id").annotate(
+            total=Sum("score")
+        ).order_by("-total", "neighbour_id").values_list(
+            "neighbour_id", flat=True)[:limit]
+    )
@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import similarity, timeline
+from .indexes import bump_index_version
+from .models import Ingredient, Recipe, RecipeIngredient, Subscription
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.schedule_backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def purge_timeline(sender, instance, **kwargs):
+    timeline.purge(instance.user_id, instance.author_id)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def touch_recipe(sender, instance, raw=False, **kwargs):
+    # Ингредиенты — часть рецепта, их изменение меняет и рецепт. Строки
+    # удаляются и в обход API: встроенной формой админки, запросом или
+    # каскадом вместе с ингредиентом.
+    if not raw:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            updated_at=timezone.now())
+        bump_index_version()
+        similarity.schedule_update(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, instance, **kwargs):
+    # Вместе с рецептом или ингредиентом удаляются их строки
+    # RecipeIngredient
+    bump_index_version()
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created, raw=False,
+                             **kwargs):
+    if not created and not raw:
+        Recipe.objects.filter(ingredients=instance).update(
+            updated_at=timezone.now())
@@ -0,0 +1,199 @@
+"""
+Похожие рецепты по наборам ингредиентов: MinHash и LSH.
+
+Для каждого рецепта хранится MinHash-сигнатура набора ингредиентов:
+вероятность совпадения позиции в двух сигнатурах равна коэффициенту
+Жаккара наборов. Сигнатура делится на полосы, и рецепт попадает в
+корзину каждой полосы (RecipeBucket). Кандидаты в похожие — рецепты,
+совпавшие с данным хотя бы в одной корзине, поэтому поиск не
+сравнивает рецепт со всем каталогом.
+
+Сигнатуры обновляются в фоновом потоке после изменения ингредиентов
+рецепта, полностью индекс строится командой build_similarity. Для
+построения и поиска нужна только база данных.
+
+Версия похожих рецептов хранится для каждого рецепта и меняется только
+у рецептов из корзин, которые затронуло обновление сигнатур; общая
+версия меняется при полном перестроении.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Recipe, RecipeBucket, RecipeIngredient, RecipeSignature
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+PRIME = (1 << 31) - 1
+SEED = 20240101
+BATCH_SIZE = 1000
+VERSION_KEY = "recipes:similarity:version"
+RECIPE_VERSION_KEY = "recipes:similarity:version:{}"
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similarity")
+
+_rng = np.random.default_rng(SEED)
+_A = _rng.integers(1, PRIME, size=NUM_PERM, dtype=np.int64)
+_B = _rng.integers(0, PRIME, size=NUM_PERM, dtype=np.int64)
+# Коэффициенты хэша полосы; переполнение uint64 здесь допустимо
+_BAND_COEFFS = _rng.integers(
+    1, 1 << 62, size=ROWS, dtype=np.int64).astype(np.uint64)
+
+
+def minhash(ingredient_ids):
+    """MinHash-сигнатура набора id ингредиентов."""
+    values = np.asarray(ingredient_ids, dtype=np.int64)
+    hashes = (_A[:, None] * values[None, :] + _B[:, None]) % PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signature):
+    """Номера корзин для каждой полосы сигнатуры."""
+    bands = signature.astype(np.uint64).reshape(BANDS, ROWS)
+    with np.errstate(over="ignore"):
+        buckets = (bands * _BAND_COEFFS).sum(axis=1, dtype=np.uint64)
+    return buckets.view(np.int64).tolist()
+
+
+def get_version(recipe_id):
+    """Версия похожих рецептов для ``recipe_id``."""
+    keys = [VERSION_KEY, RECIPE_VERSION_KEY.format(recipe_id)]
+    for key in keys:
+        cache.add(key, time.time_ns(), timeout=None)
+    versions = cache.get_many(keys)
+    return ":".join(str(versions.get(key)) for key in keys)
+
+
+def same_bucket(buckets):
+    """Условие на RecipeBucket: любая из пар (полоса, корзина)."""
+    condition = Q()
+    for band, bucket in buckets:
+        condition |= Q(band=band, bucket=bucket)
+    return condition
+
+
+def invalidate(recipe_ids, buckets):
+    """
+    Меняет версию похожих рецептов для ``recipe_ids`` и всех рецептов
+    из корзин ``buckets``.
+    """
+    affected = set(recipe_ids)
+    if buckets:
+        affected.update(RecipeBucket.objects.filter(
+            same_bucket(buckets)).values_list("recipe_id", flat=True))
+    version = time.time_ns()
+    cache.set_many(
+        {RECIPE_VERSION_KEY.format(pk): version for pk in affected},
+        timeout=None,
+    )
+
+
+def update_signatures(recipe_ids, invalidate_similar=True):
+    """
+    Пересчитывает сигнатуры и корзины рецептов. С
+    ``invalidate_similar`` сбрасывает похожие рецепты из прежних и
+    новых корзин этих рецептов.
+    """
+    recipe_ids = list(recipe_ids)
+    ingredients = {}
+    for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list("recipe_id", "ingredient_id"):
+        ingredients.setdefault(recipe_id, []).append(ingredient_id)
+
+    signatures, buckets = [], []
+    for recipe_id, ingredient_ids in ingredients.items():
+        signature = minhash(ingredient_ids)
+        signatures.append(RecipeSignature(
+            recipe_id=recipe_id, minhash=signature.tobytes()))
+        buckets.extend(
+            RecipeBucket(recipe_id=recipe_id, band=band, bucket=bucket)
+            for band, bucket in enumerate(band_buckets(signature))
+        )
+
+    with transaction.atomic():
+        old = RecipeBucket.objects.filter(recipe_id__in=recipe_ids)
+        touched = set()
+        if invalidate_similar:
+            touched.update(old.values_list("band", "bucket"))
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        old.delete()
+        RecipeSignature.objects.bulk_create(signatures, batch_size=BATCH_SIZE)
+        RecipeBucket.objects.bulk_create(buckets, batch_size=BATCH_SIZE)
+    if invalidate_similar:
+        touched.update((item.band, item.bucket) for item in buckets)
+        invalidate(recipe_ids, touched)
+
+
+def schedule_update(recipe_id):
+    """
+    Обновляет сигнатуру рецепта после фиксации транзакции, по
+    умолчанию в фоновом потоке.
+    """
+    if not getattr(settings, "SIMILARITY_UPDATE_ASYNC", True):
+        transaction.on_commit(lambda: update_signatures([recipe_id]))
+        return
+    transaction.on_commit(
+        lambda: _executor.submit(_run_update, recipe_id)
+    )
+
+
+def _run_update(recipe_id):
+    try:
+        update_signatures([recipe_id])
+    except Exception:
+        logger.exception(
+            "Similarity update failed for recipe %s", recipe_id)
+    finally:
+        # Соединение фонового потока не должно оставаться открытым
+        connection.close()
+
+
+def rebuild():
+    """
+    Строит индекс заново по всем рецептам, возвращает их количество.
+    Рецепты обновляются пачками, поэтому поиск работает и во время
+    перестроения.
+    """
+    recipe_ids = list(Recipe.objects.values_list("id", flat=True))
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        update_signatures(
+            recipe_ids[start:start + BATCH_SIZE], invalidate_similar=False)
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    return len(recipe_ids)
+
+
+def find_similar(recipe_id, limit):
+    """
+    Список (id рецепта, оценка коэффициента Жаккара) похожих рецептов
+    по убыванию сходства.
+    """
+    signature = RecipeSignature.objects.filter(
+        recipe_id=recipe_id).values_list("minhash", flat=True).first()
+    if signature is None:
+        return []
+    signature = np.frombuffer(bytes(signature), dtype=np.uint32)
+
+    candidates = list(RecipeSignature.objects.filter(
+        recipe_id__in=RecipeBucket.objects.filter(same_bucket(
+            enumerate(band_buckets(signature)))).values("recipe_id")
+    ).exclude(recipe_id=recipe_id).values_list("recipe_id", "minhash"))
+    if not candidates:
+        return []
+
+    ids, signatures = zip(*candidates)
+    matrix = np.frombuffer(
+        b"".join(bytes(value) for value in signatures), dtype=np.uint32
+    ).reshape(len(ids), NUM_PERM)
+    scores = (matrix == signature).mean(axis=1)
+    order = np.lexsort((np.array(ids), -scores))[:limit]
+    return [(ids[index], float(scores[index])) for index in order]
@@ -0,0 +1,104 @@
+"""
+Ленты подписок (fan-out on write).
+
+Новый рецепт сразу раскладывается по лентам подписчиков автора. При
+подписке лента дополняется уже опубликованными рецептами автора в
+фоновом потоке, при отписке записи автора из ленты удаляются.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Recipe, Subscription, TimelineEntry
+
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeline")
+
+
+def fan_out(recipe):
+    """Добавляет рецепт в ленты всех подписчиков автора."""
+    followers = Subscription.objects.filter(
+        author_id=recipe.author_id
+    ).values_list("user_id", flat=True).iterator(chunk_size=BATCH_SIZE)
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                recipe_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date,
+            )
+            for user_id in followers
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """
+    Добавляет в ленту пользователя все рецепты автора, если подписка
+    ещё существует.
+    """
+    with transaction.atomic():
+        # Строка подписки заблокирована до конца заполнения: отписка
+        # дождётся его и удалит добавленные записи, а после отписки
+        # заполнять уже нечего
+        subscription = Subscription.objects.select_for_update().filter(
+            user_id=user_id, author_id=author_id)
+        if not list(subscription.values_list("id", flat=True)):
+            return
+        recipes = Recipe.objects.filter(author_id=author_id).values_list(
+            "id", "pub_date").iterator(chunk_size=BATCH_SIZE)
+        TimelineEntry.objects.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in recipes
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+
+def purge(user_id, author_id):
+    """Удаляет рецепты автора из ленты пользователя."""
+    purge_many(user_id, [author_id])
+
+
+def purge_many(user_id, author_ids):
+    """Удаляет рецепты нескольких авторов из ленты пользователя."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids).delete()
+
+
+def schedule_backfill(user_id, author_id):
+    """Запускает заполнение ленты после фиксации транзакции подписки."""
+    if not getattr(settings, "TIMELINE_BACKFILL_ASYNC", True):
+        backfill(user_id, author_id)
+        return
+    transaction.on_commit(
+        lambda: _executor.submit(_run_backfill, user_id, author_id)
+    )
+
+
+def _run_backfill(user_id, author_id):
+    # Исключение в потоке исполнителя иначе осталось бы незамеченным
+    try:
+        backfill(user_id, author_id)
+    except Exception:
+        logger.exception(
+            "Timeline backfill failed for user %s, author %s",
+            user_id, author_id)
+    finally:
+        # Соединение фонового потока не должно оставаться открытым
+        connection.close()
@@ -29,6 +29,12 @@ class User(AbstractUser):
         blank=False,  
         null=False    
     )
+
+    updated_at = models.DateTimeField(
+        'дата изменения',
+        auto_now=True,
+        db_index=True
+    )
     
     class Meta:
         verbose_name = 'Пользователь'